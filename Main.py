@@ -1,16 +1,35 @@
 from  blockchain.blockchain import BlockChain
 from blockchain.Wallet import Wallet
+from blockchain.Miner import Miner
 from networking.Node import Node
+from networking.AsyncNode import AsyncNode
 from gui.app import app
 import threading
 import time
+import os
+
+# 'log' keeps blocks in the append-only block log, 'sqlite' in my_data/chain.db
+STORAGE_BACKEND = 'log'
+
+# Pruned node: keep every header but block bodies only for the newest blocks / megabytes, None keeps everything
+PRUNE_KEEP_BLOCKS = None
+PRUNE_KEEP_MEGABYTES = None
+
+# 'asyncio' serves every peer from one event loop, 'threads' uses a thread per connection
+NODE_TRANSPORT = 'asyncio'
+
+# Processes that check transaction signatures for incoming blocks and relayed transactions
+VERIFY_WORKERS = os.cpu_count() or 1
 
 def main():
     # Initialize everything
     print("Starting blockchain System...")
 
     # Load or create blockchain
-    blockchain = BlockChain()
+    prune_keep_bytes = PRUNE_KEEP_MEGABYTES * 1024 * 1024 if PRUNE_KEEP_MEGABYTES is not None else None
+    blockchain = BlockChain(mining_workers=os.cpu_count() or 1, storage=STORAGE_BACKEND,
+                            prune_keep_blocks=PRUNE_KEEP_BLOCKS, prune_keep_bytes=prune_keep_bytes,
+                            verify_workers=VERIFY_WORKERS)
 
     # Create or load wallets
     mywallet = Wallet()
@@ -18,7 +37,8 @@ def main():
     print(f"Wallet : {mywallet.address} has been loaded")
 
     # START NODE SERVER IN BACKGROUND THREAD
-    My_Node = Node(port=24, host='10.238.72.75') # Your node class
+    node_class = AsyncNode if NODE_TRANSPORT == 'asyncio' else Node
+    My_Node = node_class(port=24, host='10.238.72.75', blockchain=blockchain) # Your node class
     server_thread = threading.Thread(target=My_Node.start_server, daemon=True)
     server_thread.start()
     print(f"Node server started on port 5001 in background...")
@@ -33,8 +53,14 @@ def main():
     latest_tx = blockchain.get_latest_tx()
     My_Node.update_tx(latest_tx)
 
+    # START MINER IN BACKGROUND THREAD
+    miner = Miner(blockchain=blockchain, node=My_Node, address=mywallet.address)
+    My_Node.miner = miner
+    miner.start()
+
     # Pass objects to Flask
     app.config['node'] = My_Node
+    app.config['miner'] = miner
     app.config['blockchain'] = blockchain
     app.config['wallet'] = mywallet
 
@@ -1,13 +1,215 @@
 import hashlib
-import ecdsa
 import json
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from blockchain.Crypto import backend
+
+# Fee the wallet attaches when none is given, paid to the miner on top of the amount
+DEFAULT_FEE = 0.001
+
+# Signature results remembered, the least recently used are dropped past this
+VERIFY_CACHE_SIZE = 10000
+
+
+class VerifyCache:
+    """Bounded LRU of signature verification results, so a transaction seen again is not verified again"""
+
+    def __init__(self, max_size=VERIFY_CACHE_SIZE):
+        self.max_size = max_size
+        self.results = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.results)
+
+    def get(self, key):
+        """Cached result for the key, None if it has not been verified yet"""
+        with self.lock:
+            result = self.results.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self.results.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key, result):
+        with self.lock:
+            self.results[key] = result
+            self.results.move_to_end(key)
+            while len(self.results) > self.max_size:
+                self.results.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.results.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.results),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+# Shared by every transaction in this process
+verify_cache = VerifyCache()
+
+# Parsed public keys remembered, and how many of the hottest get precomputed point tables
+KEY_CACHE_SIZE = 1024
+HOT_KEY_CACHE_SIZE = 64
+# Verifies by one key before its tables are built, precompute() costs about as much as a handful of verifies
+HOT_SENDER_USES = 8
+
+
+class KeyCache:
+    """Bounded LRU of parsed public keys by their bytes, prepared by the backend once a sender turns out to be hot
+
+    Verify times are recorded per kind of lookup, so stats() can tell how much latency the cache saved. Pool
+    workers have caches of their own, the Verifier merges their timings into the parent's.
+    """
+
+    def __init__(self, max_size=KEY_CACHE_SIZE, hot_size=HOT_KEY_CACHE_SIZE, hot_uses=HOT_SENDER_USES):
+        self.max_size = max_size
+        self.hot_size = hot_size
+        self.hot_uses = hot_uses
+        self.keys = OrderedDict()  # public key bytes -> [VerifyingKey, uses]
+        self.hot = OrderedDict()  # public key bytes -> key prepared for repeated verifies
+        self.lock = threading.Lock()
+        # Per kind: 'parsed' (miss), 'cached' and 'precomputed', as [verifies, seconds]
+        self.timings = {'parsed': [0, 0.0], 'cached': [0, 0.0], 'precomputed': [0, 0.0]}
+
+    def get(self, public_key_bytes):
+        """(public key, kind of lookup)"""
+        with self.lock:
+            hot_key = self.hot.get(public_key_bytes)
+            if hot_key is not None:
+                self.hot.move_to_end(public_key_bytes)
+                return hot_key, 'precomputed'
+
+            entry = self.keys.get(public_key_bytes)
+            if entry is None:
+                kind = 'parsed'
+                entry = self.keys[public_key_bytes] = [backend.load_public_key(public_key_bytes), 0]
+                while len(self.keys) > self.max_size:
+                    self.keys.popitem(last=False)
+            else:
+                kind = 'cached'
+                self.keys.move_to_end(public_key_bytes)
+            entry[1] += 1
+            if entry[1] != self.hot_uses:
+                return entry[0], kind
+
+        # Hot sender: build its tables without holding up other verifies, the plain key serves them meanwhile
+        hot_key = backend.prepare_hot_key(entry[0])
+        with self.lock:
+            self.keys.pop(public_key_bytes, None)
+            self.hot[public_key_bytes] = hot_key
+            while len(self.hot) > self.hot_size:
+                self.hot.popitem(last=False)
+        return hot_key, kind
+
+    def record(self, kind, seconds):
+        with self.lock:
+            timing = self.timings[kind]
+            timing[0] += 1
+            timing[1] += seconds
+
+    def take_timings(self):
+        """Timings recorded since the last call, which start again from zero"""
+        with self.lock:
+            timings = {kind: tuple(timing) for kind, timing in self.timings.items()}
+            for timing in self.timings.values():
+                timing[0], timing[1] = 0, 0.0
+            return timings
+
+    def merge_timings(self, timings):
+        """Add timings taken in another process"""
+        with self.lock:
+            for kind, (count, seconds) in timings.items():
+                self.timings[kind][0] += count
+                self.timings[kind][1] += seconds
+
+    def clear(self):
+        with self.lock:
+            self.keys.clear()
+            self.hot.clear()
+            for timing in self.timings.values():
+                timing[0], timing[1] = 0, 0.0
+
+    def stats(self):
+        """Mean verify time per kind of lookup, and the time saved against parsing the key every time"""
+        with self.lock:
+            means = {kind: seconds / count if count else None for kind, (count, seconds) in self.timings.items()}
+            saved = 0.0
+            if means['parsed'] is not None:
+                for kind in ('cached', 'precomputed'):
+                    count = self.timings[kind][0]
+                    if count:
+                        saved += count * (means['parsed'] - means[kind])
+            return {
+                'keys': len(self.keys),
+                'hot_keys': len(self.hot),
+                'verifies': {kind: count for kind, (count, _) in self.timings.items()},
+                'mean_verify_ms': {kind: mean * 1000 if mean is not None else None for kind, mean in means.items()},
+                'saved_ms': saved * 1000,
+            }
+
+
+key_cache = KeyCache()
+
+# Transactions paying several recipients under one signature
+MULTI_OUTPUT_VERSION = 2
+MAX_OUTPUTS = 1000
+
+
+def transaction_outputs(tx_dict):
+    """(recipient, amount) pairs a transaction dict pays out, whatever kind of transaction it is"""
+    if 'outputs' in tx_dict:
+        return [(output['recipient'], output['amount']) for output in tx_dict['outputs']]
+    return [(tx_dict['recipient'], tx_dict['amount'])]
+
+
+def transaction_total(tx_dict):
+    """Everything the transaction pays out, not counting the fee"""
+    if 'outputs' in tx_dict:
+        return sum(output['amount'] for output in tx_dict['outputs'])
+    return tx_dict['amount']
+
+
+def is_fee(value):
+    """A finite, non-negative int or float; None, bools and strings are not fees"""
+    return type(value) in (int, float) and math.isfinite(value) and value >= 0
+
+
+def has_valid_fee(tx_dict):
+    """The fee is optional, but one that is there has to be a fee"""
+    return 'fee' not in tx_dict or is_fee(tx_dict['fee'])
+
+
+def transaction_fee(tx_dict):
+    """What the sender pays the miner, of a transaction dict that passed has_valid_fee"""
+    # Transactions made before fees existed pay nothing
+    return tx_dict.get('fee', 0)
 
 
 class Transactions:
-    def __init__(self, sender, recipient, amount, sender_public_key, index=0):
+    def __init__(self, sender, recipient, amount, sender_public_key, index=0, fee=None):
         self.amount = amount
         self.recipient = recipient
         self.sender  = sender
+        self.fee = fee  # None for transactions made before fees existed
         self.signature = None
         self.tx_hash = self.calculate_hash()
         self.sender_public_key = sender_public_key
@@ -17,9 +219,15 @@ class Transactions:
         data_string = f"{self.amount}{self.recipient}{self.sender}{self.signature}"
         return hashlib.sha256(data_string.encode()).hexdigest()
 
+    def signable_data(self):
+        """What the sender signs, the fee is covered once there is one"""
+        if self.fee is None:
+            return f"{self.sender}{self.recipient}{self.amount}"
+        return f"{self.sender}{self.recipient}{self.amount}{self.fee}"
+
     def to_dict(self):
         """Convert to dictionary for JSON serialization"""
-        return {
+        tx_dict = {
             'index': self.index,
             'tx_hash': self.tx_hash,
             'sender': self.sender,
@@ -28,17 +236,32 @@ class Transactions:
             'signature': self.signature,
             'sender_public_key':self.sender_public_key,
         }
+        if self.fee is not None:
+            tx_dict['fee'] = self.fee
+        return tx_dict
+
+    def has_valid_structure(self):
+        if not all([self.sender, self.recipient, self.amount > 0, self.signature]):
+            return False
+        return self.fee is None or is_fee(self.fee)
 
     def is_valid(self, wallet_address = None, validation_type = 'Easy'):
         """Validate transaction structure and signature"""
         # Check basic structure
-
-        if not all([self.sender, self.recipient, self.amount > 0, self.signature]):
+        if not self.has_valid_structure():
             return False
 
-        # Verify signature
-        return self.verify_signature()
+        # Verify signature, unless this exact transaction has been verified before
+        key = self.verify_cache_key()
+        result = verify_cache.get(key)
+        if result is None:
+            result = self.verify_signature()
+            verify_cache.put(key, result)
+        return result
 
+    def verify_cache_key(self):
+        # tx_hash does not cover the fee, the signed data does, so a changed fee is never a hit
+        return self.tx_hash, self.signature, self.sender_public_key, self.signable_data()
 
     def verify_signature(self):
         """Verify the transaction signature"""
@@ -46,29 +269,91 @@ class Transactions:
             return False
 
         # Recreate the signed data
-        signable_data = f"{self.sender}{self.recipient}{self.amount}"
+        signable_data = self.signable_data()
 
         try:
-            # Verify using sender's public key
-            public_key_bytes = bytes.fromhex(self.sender_public_key)
-            verifying_key = ecdsa.VerifyingKey.from_string(public_key_bytes, curve=ecdsa.SECP256k1)
-
-            return verifying_key.verify(bytes.fromhex(self.signature), signable_data.encode())
+            # Verify using sender's public key, parsed once per sender
+            # The timing covers the lookup too, so parsing and building tables count against the cache
+            start = time.perf_counter()
+            public_key, kind = key_cache.get(bytes.fromhex(self.sender_public_key))
+            valid = backend.verify(public_key, bytes.fromhex(self.signature), signable_data.encode())
+            key_cache.record(kind, time.perf_counter() - start)
+            return valid
 
         except:
             return False
 
     @classmethod
     def from_dict(cls, data):
+        if 'outputs' in data:
+            return MultiOutputTransaction.from_dict(data)
         transaction = cls(
             index = data['index'],
             sender=data['sender'],
             recipient=data['recipient'],
             amount=data['amount'],
-            sender_public_key = data['sender_public_key']
+            sender_public_key = data['sender_public_key'],
+            fee=data.get('fee')
         )
         transaction.tx_hash = data['tx_hash']
         transaction.signature = data['signature']
         return transaction
 
 
+
+
+class MultiOutputTransaction(Transactions):
+    """One sender paying several recipients, signed once over a canonical encoding of all the outputs"""
+
+    def __init__(self, sender, outputs, sender_public_key, index=0, fee=DEFAULT_FEE):
+        self.outputs = [(recipient, amount) for recipient, amount in outputs]
+        self.version = MULTI_OUTPUT_VERSION
+        super().__init__(sender, None, sum(amount for _, amount in self.outputs), sender_public_key, index, fee)
+
+    def canonical_outputs(self):
+        return json.dumps([[recipient, amount] for recipient, amount in self.outputs], separators=(',', ':'))
+
+    def calculate_hash(self):
+        # Blocks only commit to tx_hash, so it covers every output and the fee
+        data_string = f"{self.version}:{self.sender}:{self.canonical_outputs()}:{self.fee}:{self.signature}"
+        return hashlib.sha256(data_string.encode()).hexdigest()
+
+    def signable_data(self):
+        return f"{self.version}:{self.sender}:{self.canonical_outputs()}:{self.fee}"
+
+    def to_dict(self):
+        return {
+            'version': self.version,
+            'index': self.index,
+            'tx_hash': self.tx_hash,
+            'sender': self.sender,
+            'outputs': [{'recipient': recipient, 'amount': amount} for recipient, amount in self.outputs],
+            'signature': self.signature,
+            'sender_public_key': self.sender_public_key,
+            'fee': self.fee,
+        }
+
+    def has_valid_structure(self):
+        if not all([self.sender, self.signature, 0 < len(self.outputs) <= MAX_OUTPUTS]):
+            return False
+        for recipient, amount in self.outputs:
+            if not recipient or type(amount) not in (int, float) or not amount > 0:
+                return False
+        if not is_fee(self.fee):
+            return False
+        return self.tx_hash == self.calculate_hash()
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get('version') != MULTI_OUTPUT_VERSION:
+            raise ValueError(f"unknown transaction version {data.get('version')}")
+        transaction = cls(
+            index=data['index'],
+            sender=data['sender'],
+            outputs=[(output['recipient'], output['amount']) for output in data['outputs']],
+            sender_public_key=data['sender_public_key'],
+            fee=data['fee']
+        )
+        transaction.signature = data['signature']
+        transaction.tx_hash = data['tx_hash']
+        return transaction
@@ -0,0 +1,55 @@
+"""Encode/decode throughput and size of the binary codec against json, run with: python -m benchmarks.codec_benchmark"""
+import json
+import time
+
+from blockchain import Codec
+
+ROUNDS = 2000
+
+
+def load_blocks(path='my_data/blockchain.json'):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def measure(label, function, argument, rounds=ROUNDS):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        function(argument)
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<14} {rounds / elapsed:>12,.0f} ops/s")
+
+
+def json_encode(value):
+    return json.dumps(value, separators=(',', ':')).encode()
+
+
+def main():
+    blocks = load_blocks()
+    transactions = [tx for block in blocks for tx in block['transactions']]
+
+    signed = next(tx for tx in transactions if 'signature' in tx)
+
+    cases = [
+        ('transaction', signed, Codec.encode_transaction, Codec.decode_transaction),
+        ('block', max(blocks, key=lambda block: len(block['transactions'])), Codec.encode_block, Codec.decode_block),
+    ]
+    for name, value, encode, decode in cases:
+        encoded = encode(value)
+        as_json = json_encode(value)
+        assert decode(encoded) == value, f"{name} did not round-trip"
+
+        print(f"{name}: {len(encoded)} bytes binary, {len(as_json)} bytes json "
+              f"({len(encoded) / len(as_json):.0%})")
+        measure('binary encode', encode, value)
+        measure('json encode', json_encode, value)
+        measure('binary decode', decode, encoded)
+        measure('json decode', json.loads, as_json)
+
+    chain_binary = sum(len(Codec.encode_block(block)) for block in blocks)
+    chain_json = sum(len(json_encode(block)) for block in blocks)
+    print(f"whole chain ({len(blocks)} blocks): {chain_binary} bytes binary, {chain_json} bytes json")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""Sign and verify throughput of every crypto backend, run with: python -m benchmarks.crypto_benchmark"""
+import time
+
+from blockchain import Crypto
+
+ROUNDS = 200
+MESSAGE = b"1HZN9b2CbZHQS9FULHWmeeLKcGkgf6Pxe61BvBMSEYstWetqTFn5Au4m4GFg7xJaNVN210.00.001"
+
+
+def measure(label, function, rounds=ROUNDS):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        function()
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<18} {rounds / elapsed:>10,.0f} ops/s")
+
+
+def main():
+    print(f"default backend: {Crypto.backend.name}")
+    backends = [Crypto.get_backend(name) for name in Crypto.available_backends()]
+    missing = [name for name in Crypto.BACKENDS if name not in Crypto.available_backends()]
+    if missing:
+        print(f"not importable here: {', '.join(missing)}")
+
+    for backend in backends:
+        private_key_bytes = backend.generate_private_key()
+        private_key = backend.load_private_key(private_key_bytes)
+        public_key_bytes = backend.public_key_bytes(private_key)
+        public_key = backend.load_public_key(public_key_bytes)
+        hot_key = backend.prepare_hot_key(backend.load_public_key(public_key_bytes))
+        signature = backend.sign(private_key, MESSAGE)
+
+        # Every backend has to accept every other backend's keys and signatures
+        for other in backends:
+            other_key = other.load_public_key(public_key_bytes)
+            assert other.verify(other_key, signature, MESSAGE), f"{other.name} rejects a {backend.name} signature"
+
+        print(f"{backend.name}:")
+        measure('sign', lambda: backend.sign(private_key, MESSAGE))
+        measure('verify', lambda: backend.verify(public_key, signature, MESSAGE))
+        measure('verify (hot key)', lambda: backend.verify(hot_key, signature, MESSAGE))
+        measure('parse + verify', lambda: backend.verify(backend.load_public_key(public_key_bytes), signature,
+                                                         MESSAGE))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+import os
+
+from Transactions import transaction_outputs
+
+
+class AddressIndex:
+    """address -> [(block height, position in block)] for every transaction, kept in chain order"""
+
+    def __init__(self, path='my_data/address_index.log'):
+        # Append-only log: one 'T height position address' line per entry, then 'B height hash' once a block is done
+        self.path = path
+        self.entries = {}
+        self.height = 0  # Number of blocks indexed
+        self.tip_hash = None
+        self._file = None
+
+    @staticmethod
+    def addresses_of(transaction):
+        # Each address once, even when it is paid by several outputs or pays itself
+        addresses = list(dict.fromkeys(recipient for recipient, _ in transaction_outputs(transaction)))
+        sender = transaction.get('sender')
+        if sender and sender not in addresses:
+            addresses.append(sender)
+        return addresses
+
+    def connect_block(self, block, height):
+        lines = []
+        for position, transaction in enumerate(block['transactions']):
+            for address in self.addresses_of(transaction):
+                self.entries.setdefault(address, []).append((height, position))
+                lines.append(f"T {height} {position} {address}\n")
+        lines.append(f"B {height} {block['hash']}\n")
+
+        self._file.write(''.join(lines))
+        self._file.flush()
+        self.height = height + 1
+        self.tip_hash = block['hash']
+
+    def count(self, address):
+        return len(self.entries.get(address, ()))
+
+    def get_page(self, address, page=1, page_size=10):
+        """Positions for one page of an address's history, newest first"""
+        positions = self.entries.get(address, [])
+        end = len(positions) - (page - 1) * page_size
+        start = max(end - page_size, 0)
+        if end <= 0:
+            return []
+        return positions[start:end][::-1]
+
+    def sync(self, store):
+        """Load the log up to its last complete block and index the blocks it is missing"""
+        self.load()
+        if self.height > len(store) or (self.height and store.get_block_hash(self.height - 1) != self.tip_hash):
+            print("Address index does not match the chain, rebuilding it")
+            self.rebuild(store)
+            return
+
+        self._file = open(self.path, 'a')
+        self.connect_blocks(store, self.height)
+
+    def rebuild(self, store):
+        self.close()
+        self.entries, self.height, self.tip_hash = {}, 0, None
+        self._file = open(self.path, 'w')
+        self.connect_blocks(store, 0)
+
+    def connect_blocks(self, store, start):
+        for height, block in enumerate(store.iter_blocks(start), start):
+            if block is None:
+                # Body was pruned, the block is marked as indexed but its history is gone
+                block = {'hash': store.get_block_hash(height), 'transactions': []}
+            self.connect_block(block, height)
+
+    def load(self):
+        self.entries, self.height, self.tip_hash = {}, 0, None
+        if not os.path.exists(self.path):
+            return
+
+        entries = {}
+        valid_size = 0
+        read_size = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # torn final write
+                read_size += len(line)
+                parts = line.decode().split()
+                if parts[0] == 'T':
+                    entries.setdefault(parts[3], []).append((int(parts[1]), int(parts[2])))
+                elif parts[0] == 'B':
+                    # Entries only count once their block marker made it to disk
+                    for address, positions in entries.items():
+                        self.entries.setdefault(address, []).extend(positions)
+                    entries = {}
+                    self.height = int(parts[1]) + 1
+                    self.tip_hash = parts[2]
+                    valid_size = read_size
+
+        # Drop anything after the last complete block
+        if os.path.getsize(self.path) != valid_size:
+            with open(self.path, 'r+b') as f:
+                f.truncate(valid_size)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
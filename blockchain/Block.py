@@ -1,83 +1,269 @@
 import hashlib
 import json
+import struct
+import threading
+import time
+
+from .MerkleTree import MerkleTree
+from .Workers import shared_pool
+from .Difficulty import LEGACY_TARGET, POW_LIMIT_BITS, bits_to_target, block_target, difficulty_from_target
+
+# Version 1 blocks hash a JSON header, version 2 blocks hash a fixed-layout binary header,
+# version 3 blocks build their merkle tree from raw digests instead of hex strings
+# and version 4 headers also commit to a timestamp and the target the block was mined at
+LEGACY_JSON_VERSION = 1
+BINARY_HEADER_VERSION = 2
+RAW_MERKLE_VERSION = 3
+TARGET_HEADER_VERSION = 4
+BLOCK_VERSION = TARGET_HEADER_VERSION
+
+# Binary header layout: version (4 bytes) | previous hash (32) | merkle root (32) | nonce (8)
+# from version 4: version (4) | previous hash (32) | merkle root (32) | timestamp (8) | bits (4) | nonce (8)
+HEADER_PREFIX_FORMAT = struct.Struct('>I32s32s')
+TARGET_HEADER_PREFIX_FORMAT = struct.Struct('>I32s32sQI')
+NONCE_FORMAT = struct.Struct('>Q')
+
+# Number of nonces each worker searches per round when mining in parallel
+NONCE_CHUNK_SIZE = 50000
+
+# How often (in nonces) a worker checks whether another worker already won below it
+STOP_CHECK_INTERVAL = 1000
+
+# Lowest winning nonce of the current round, shared by the pool processes; NO_WINNER until one is found
+NO_WINNER = 2 ** 64 - 1
+_best_nonce = None
+
+# The mining pool and its shared nonce serve one block at a time
+_mining_lock = threading.Lock()
+
+
+def _init_mining_worker(best_nonce):
+    global _best_nonce
+    _best_nonce = best_nonce
+
+
+def _new_best_nonce(context):
+    return context.Value('Q', NO_WINNER)
+
+
+def _beaten(nonce):
+    """True once another worker has won with a lower nonce, nothing this worker finds can matter then"""
+    return nonce % STOP_CHECK_INTERVAL == 0 and _best_nonce is not None and _best_nonce.value < nonce
+
+
+def _report_win(nonce):
+    if _best_nonce is not None:
+        with _best_nonce.get_lock():
+            if nonce < _best_nonce.value:
+                _best_nonce.value = nonce
+
+
+def header_prefix(version, prev_hash, merkel_root, timestamp=None, bits=None):
+    """Everything in the binary header except the nonce, which always comes last"""
+    if version >= TARGET_HEADER_VERSION:
+        return TARGET_HEADER_PREFIX_FORMAT.pack(version, bytes.fromhex(prev_hash), bytes.fromhex(merkel_root),
+                                                timestamp, bits)
+    return HEADER_PREFIX_FORMAT.pack(version, bytes.fromhex(prev_hash), bytes.fromhex(merkel_root))
+
+
+def header_midstate(version, prev_hash, merkel_root, timestamp=None, bits=None):
+    """SHA-256 state after the constant header prefix, copy it and feed the nonce for each attempt"""
+    return hashlib.sha256(header_prefix(version, prev_hash, merkel_root, timestamp, bits))
+
+
+def legacy_header_hash(prev_hash, merkel_root, nonce):
+    header_data = {
+        'version':1,
+        'previous_hash': prev_hash,
+        'nonce': nonce,
+        'merkel_root': merkel_root
+    }
+    header_string = json.dumps(header_data, sort_keys=True)
+    return hashlib.sha256(header_string.encode()).hexdigest()
+
+
+def header_hash(version, prev_hash, merkel_root, nonce, midstate=None, timestamp=None, bits=None):
+    """Hash a block header the way its version says it was hashed"""
+    if version == LEGACY_JSON_VERSION:
+        return legacy_header_hash(prev_hash, merkel_root, nonce)
+
+    if midstate is None:
+        midstate = header_midstate(version, prev_hash, merkel_root, timestamp, bits)
+    hasher = midstate.copy()
+    hasher.update(NONCE_FORMAT.pack(nonce))
+    return hasher.hexdigest()
+
+
+def verify_block_hash(block):
+    """Check that a block dict's stored hash matches its header"""
+    block_hash = header_hash(block['version'], block['previous_hash'], block['merkle_root'], block['nonce'],
+                             timestamp=block.get('timestamp'), bits=block.get('bits'))
+    return block_hash == block['hash']
+
+
+def verify_proof_of_work(block):
+    """Check that a block dict's hash is at or below the target it was mined at"""
+    return int(block['hash'], 16) <= block_target(block)
+
+
+def verify_merkle_root(block):
+    """Check that a block dict's merkle root matches its transactions"""
+    tx_hashes = [tx['tx_hash'] for tx in block['transactions']]
+    merkle_tree = MerkleTree(tx_hashes, legacy=block['version'] < RAW_MERKLE_VERSION)
+    return merkle_tree.root == block['merkle_root']
+
+
+def search_nonce_range(version, prev_hash, merkel_root, target, start, end, timestamp=None, bits=None):
+    """Look for the first nonce whose hash is at or below target in [start, end)
+
+    Gives up early once another worker has won with a lower nonce, so the round still yields the lowest one.
+    """
+    if version == LEGACY_JSON_VERSION:
+        for nonce in range(start, end):
+            if _beaten(nonce):
+                return None
+
+            block_hash = legacy_header_hash(prev_hash, merkel_root, nonce)
+            if int(block_hash, 16) <= target:
+                _report_win(nonce)
+                return [block_hash, nonce]
+        return None
+
+    midstate = header_midstate(version, prev_hash, merkel_root, timestamp, bits)
+    pack_nonce = NONCE_FORMAT.pack
+    for nonce in range(start, end):
+        if _beaten(nonce):
+            return None
+
+        hasher = midstate.copy()
+        hasher.update(pack_nonce(nonce))
+        digest = hasher.digest()
+        if int.from_bytes(digest, 'big') <= target:
+            # Tell the workers searching higher nonces to stop
+            _report_win(nonce)
+            return [digest.hex(), nonce]
+    return None
 
 
 class Block:
-    def __init__(self, transactions, index, prev_hash, version):
+    def __init__(self, transactions, index, prev_hash, version, workers=1, bits=None, timestamp=None):
         self.index = index
         self.version = version
         self.transactions = transactions
         self.prev_hash = prev_hash
         self.nonce = 0
-        self.difficulty = 2
-        self.current_hash = self.calculate_block_hash()
+        self.workers = workers
+        self.hashes_tried = 0
+
+        # Older versions were all mined at the fixed legacy target and carry no timestamp
+        self.bits = None
+        self.timestamp = None
+        self.target = LEGACY_TARGET
+        if self.version >= TARGET_HEADER_VERSION:
+            self.bits = bits if bits is not None else POW_LIMIT_BITS
+            self.timestamp = timestamp if timestamp is not None else int(time.time())
+            self.target = bits_to_target(self.bits)
+
+        # The merkle root and header prefix only change with the transactions, compute them once
         self.merkel_root = self.cal_merkel_root()
+        self.midstate = None
+        self.refresh_midstate()
+        self.current_hash = self.calculate_block_hash()
 
 
     def cal_merkel_root(self):
-        transaction_list = [tx.tx_hash for tx in self.transactions]
+        self.merkle_tree = MerkleTree([tx.tx_hash for tx in self.transactions],
+                                      legacy=self.version < RAW_MERKLE_VERSION)
+        return self.merkle_tree.root
+
+    def add_transaction(self, transaction):
+        """Append a transaction to the block template without rebuilding the merkle tree"""
+        self.transactions.append(transaction)
+        self.merkle_tree.append(transaction.tx_hash)
+        self.merkel_root = self.merkle_tree.root
+        self.refresh_midstate()
+        self.current_hash = self.calculate_block_hash()
+
+    def refresh_midstate(self):
+        if self.version != LEGACY_JSON_VERSION:
+            self.midstate = header_midstate(self.version, self.prev_hash, self.merkel_root, self.timestamp, self.bits)
 
-        current_level = []
-        for value in transaction_list:
-            if isinstance(value, str):
-                hashed = hashlib.sha256(value.encode()).hexdigest()
-            else:
-                hashed = hashlib.sha256(value.to_bytes(8, 'big')).hexdigest()
-            current_level.append(hashed)
+    def calculate_block_hash(self):
+        return header_hash(self.version, self.prev_hash, self.merkel_root, self.nonce, self.midstate,
+                           self.timestamp, self.bits)
 
+    def mining(self, cancel_event=None):
+        """Search for a valid nonce, returns None if cancel_event is set before one is found"""
+        if self.workers > 1:
+            return self.parallel_mining(cancel_event)
 
-        while len(current_level) > 1:
-            next_level = []  # Reset for each iteration
+        while True:
+            if cancel_event is not None and cancel_event.is_set():
+                return None
 
-            for i in range(0, len(current_level), 2):
-                # Get left element
-                left = current_level[i]
+            result = search_nonce_range(self.version, self.prev_hash, self.merkel_root, self.target,
+                                        self.nonce, self.nonce + NONCE_CHUNK_SIZE, self.timestamp, self.bits)
+            if result:
+                self.current_hash, self.nonce = result
+                break
+            self.nonce += NONCE_CHUNK_SIZE
+            self.hashes_tried += NONCE_CHUNK_SIZE
+        data = [self.current_hash, self.nonce]
+        return data
 
-                # Check if right element exists
-                if i + 1 < len(current_level):
-                    right = current_level[i + 1]
-                else:
-                    right = left  # Duplicate if odd number
+    def parallel_mining(self, cancel_event=None):
+        """Split the nonce space into disjoint ranges and search them across a process pool
 
-                # Combine and hash (or in your case, add numbers)
-                combined = left + right
-                combined_hash = hashlib.sha256(combined.encode()).hexdigest()
-                next_level.append(combined_hash)
+        Finds the same nonce as mining with one worker. The pool is started once and kept for the next blocks.
+        """
+        with _mining_lock:
+            pool, best_nonce = shared_pool('mining', self.workers, _init_mining_worker, _new_best_nonce)
+            best_nonce.value = NO_WINNER
+            start = self.nonce
+            while True:
+                if cancel_event is not None and cancel_event.is_set():
+                    return None
 
-            current_level = next_level
-              # Debug output
+                # One chunk of nonces per worker for this round
+                jobs = []
+                for i in range(self.workers):
+                    chunk_start = start + i * NONCE_CHUNK_SIZE
+                    jobs.append(pool.apply_async(
+                        search_nonce_range,
+                        (self.version, self.prev_hash, self.merkel_root, self.target,
+                         chunk_start, chunk_start + NONCE_CHUNK_SIZE, self.timestamp, self.bits)
+                    ))
 
-        return current_level[0]
+                found = [result for result in (job.get() for job in jobs) if result]
+                if found:
+                    # Workers below the first winner kept going, the lowest nonce found is the first valid one
+                    self.current_hash, self.nonce = min(found, key=lambda result: result[1])
+                    break
 
-    def calculate_block_hash(self):
-        header_data = {
-            'version':1,
-            'previous_hash': self.prev_hash,
-            'nonce': self.nonce,
-            'merkel_root': self.cal_merkel_root()
-        }
-        header_string = json.dumps(header_data, sort_keys=True)
-        return hashlib.sha256(header_string.encode()).hexdigest()
+                start += self.workers * NONCE_CHUNK_SIZE
+                self.hashes_tried += self.workers * NONCE_CHUNK_SIZE
 
-    def mining(self):
-        while self.calculate_block_hash()[:self.difficulty] != "0" * self.difficulty:
-            self.nonce += 1
-            self.current_hash = self.calculate_block_hash()
         data = [self.current_hash, self.nonce]
         return data
 
 
-    def block_header(self):
-        mining_data  = self.mining()
+    def block_header(self, cancel_event=None):
+        mining_data  = self.mining(cancel_event)
+        if mining_data is None:
+            return None
+
         block_header = {
             "version": self.version,  # Protocol version
             "index": self.index,  # Block height/number
             "previous_hash": self.prev_hash,
             "merkle_root": self.merkel_root,
             "nonce": mining_data[1],
-            "difficulty": 4,
+            "difficulty": difficulty_from_target(self.target),
             "hash": mining_data[0],
         }
+        if self.version >= TARGET_HEADER_VERSION:
+            block_header["timestamp"] = self.timestamp
+            block_header["bits"] = self.bits
         return block_header
 
 
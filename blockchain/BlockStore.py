@@ -0,0 +1,453 @@
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+from blockchain.Codec import decode_header, decode_transactions, encode_header, encode_transactions
+
+# Every block is one framed record: magic (4 bytes) | payload length (4) | crc32 of payload (4) | payload
+FRAME_HEADER_FORMAT = struct.Struct('>4sII')
+
+# The payload is split so the header can be sliced out on its own:
+# header length (4) | transaction count (4) | binary header | binary transactions (see Codec.py)
+FRAME_MAGIC = b'BCB3'
+PAYLOAD_PREFIX_FORMAT = struct.Struct('>II')
+
+# Headers of pruned blocks live on in their own file as frames holding just the binary header
+HEADER_FRAME_MAGIC = b'BCHD'
+HEADERS_FILE = 'headers.dat'
+FRAME_MAGICS = (FRAME_MAGIC, HEADER_FRAME_MAGIC)
+
+# Offset table with one fixed-width record per height:
+# height (8) | segment number (4) | frame offset (8) | payload length (4) | header length (4) | tx count (4) | hash (32)
+INDEX_RECORD_FORMAT = struct.Struct('>QIQIII32s')
+INDEX_FILE = 'blocks.idx'
+
+# Start a new segment file once the current one grows past this many bytes
+SEGMENT_SIZE = 16 * 1024 * 1024
+
+# Pruning drops whole segments, so pruned stores use smaller ones
+PRUNE_SEGMENT_SIZE = 1024 * 1024
+
+# Segment number recorded in the offset table for blocks whose body was pruned, offset points into headers.dat
+PRUNED_SEGMENT = 0xFFFFFFFF
+
+
+class BlockStore:
+    """Append-only block log: blocks are framed records in memory-mapped segment files plus a fixed-width offset table
+
+    With prune_keep_blocks and/or prune_keep_bytes set the store keeps every header but only the newest bodies,
+    when both are set a body is kept if either limit covers it.
+    """
+
+    def __init__(self, path='my_data/blocks', legacy_path='my_data/blockchain.json', segment_size=None,
+                 prune_keep_blocks=None, prune_keep_bytes=None):
+        self.path = path
+        self.index_path = os.path.join(path, INDEX_FILE)
+        self.headers_path = os.path.join(path, HEADERS_FILE)
+        self.prune_keep_blocks = prune_keep_blocks
+        self.prune_keep_bytes = prune_keep_bytes
+        self.pruning = prune_keep_blocks is not None or prune_keep_bytes is not None
+        if segment_size is None:
+            segment_size = PRUNE_SEGMENT_SIZE if self.pruning else SEGMENT_SIZE
+        self.segment_size = segment_size
+        self.lock = threading.RLock()
+
+        self.entries = []  # height -> (segment, offset, length, header length, tx count, hash)
+        self.heights = {}  # hash -> height
+        self.pruned_height = 0  # Bodies are kept from this height on
+        self._maps = {}  # segment -> read-only mmap of the segment file
+        self._segment_file = None
+        self._index_file = None
+
+        os.makedirs(path, exist_ok=True)
+        self._recover()
+        self._open_for_append()
+
+        if not self.entries and legacy_path and os.path.exists(legacy_path):
+            self.import_json(legacy_path)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def segment_path(self, segment):
+        if segment == PRUNED_SEGMENT:
+            return self.headers_path
+        return os.path.join(self.path, f'blk{segment:05d}.dat')
+
+    # --- Recovery ---
+
+    def _recover(self):
+        """Load the offset table, drop entries whose frames never made it to disk and index frames written after it"""
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'rb') as f:
+                data = f.read()
+            usable = len(data) - len(data) % INDEX_RECORD_FORMAT.size
+            for position in range(0, usable, INDEX_RECORD_FORMAT.size):
+                height, segment, offset, length, header_length, tx_count, raw_hash = \
+                    INDEX_RECORD_FORMAT.unpack_from(data, position)
+                if height != len(self.entries):
+                    break
+                self.entries.append((segment, offset, length, header_length, tx_count, raw_hash.hex()))
+
+        # An index entry can only be trusted if its whole frame is on disk
+        while self.entries and not self._frame_is_complete(*self.entries[-1][:3]):
+            self.entries.pop()
+        self._rewrite_index_if_needed()
+
+        for height, entry in enumerate(self.entries):
+            self.heights[entry[5]] = height
+            if entry[0] == PRUNED_SEGMENT:
+                self.pruned_height = height + 1
+        self._finish_interrupted_prune()
+
+        # Frames appended after the last index write are still valid blocks
+        if self.entries:
+            segment, offset, length = self.entries[-1][:3]
+            position = offset + FRAME_HEADER_FORMAT.size + length
+        else:
+            segment, position = 0, 0
+
+        while os.path.exists(self.segment_path(segment)):
+            position = self._scan_segment(segment, position)
+            if not os.path.exists(self.segment_path(segment + 1)):
+                break
+            segment, position = segment + 1, 0
+
+    def _finish_interrupted_prune(self):
+        """Remove segments the index no longer points at and headers written for a prune that never reached the index"""
+        if self.pruned_height == len(self.entries):
+            return
+        first_segment = self.entries[self.pruned_height][0]
+        for segment in range(first_segment):
+            if os.path.exists(self.segment_path(segment)):
+                os.remove(self.segment_path(segment))
+
+        headers_end = 0
+        if self.pruned_height:
+            offset, length = self.entries[self.pruned_height - 1][1:3]
+            headers_end = offset + FRAME_HEADER_FORMAT.size + length
+        if os.path.exists(self.headers_path) and os.path.getsize(self.headers_path) > headers_end:
+            with open(self.headers_path, 'r+b') as f:
+                f.truncate(headers_end)
+
+    def _frame_is_complete(self, segment, offset, length):
+        path = self.segment_path(segment)
+        if not os.path.exists(path):
+            return False
+        end = offset + FRAME_HEADER_FORMAT.size + length
+        if os.path.getsize(path) < end:
+            return False
+
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            frame = f.read(FRAME_HEADER_FORMAT.size + length)
+        return self._decode_frame(frame) is not None
+
+    def _rewrite_index_if_needed(self):
+        expected_size = len(self.entries) * INDEX_RECORD_FORMAT.size
+        if os.path.exists(self.index_path) and os.path.getsize(self.index_path) != expected_size:
+            with open(self.index_path, 'r+b') as f:
+                f.truncate(expected_size)
+
+    def _scan_segment(self, segment, position):
+        """Index complete frames from position on and cut the segment at the first torn one"""
+        path = self.segment_path(segment)
+        with open(path, 'rb') as f:
+            f.seek(position)
+            data = f.read()
+
+        cursor = 0
+        while cursor < len(data):
+            decoded = self._decode_frame(data[cursor:])
+            if decoded is None or decoded[0] != FRAME_MAGIC:
+                print(f"Block log {path} has a torn record at {position + cursor}, truncating it")
+                with open(path, 'r+b') as f:
+                    f.truncate(position + cursor)
+                break
+
+            payload = decoded[1]
+            header_length, tx_count = PAYLOAD_PREFIX_FORMAT.unpack_from(payload)
+            start = PAYLOAD_PREFIX_FORMAT.size
+            header = decode_header(payload[start:start + header_length])
+
+            self._record_index(len(self.entries), segment, position + cursor, len(payload), header_length,
+                               tx_count, header['hash'])
+            cursor += FRAME_HEADER_FORMAT.size + len(payload)
+
+        return position + cursor
+
+    @staticmethod
+    def _decode_frame(data):
+        if len(data) < FRAME_HEADER_FORMAT.size:
+            return None
+        magic, length, checksum = FRAME_HEADER_FORMAT.unpack_from(data)
+        payload = data[FRAME_HEADER_FORMAT.size:FRAME_HEADER_FORMAT.size + length]
+        if magic not in FRAME_MAGICS or len(payload) != length or zlib.crc32(payload) != checksum:
+            return None
+        return magic, payload
+
+    # --- Writing ---
+
+    def _open_for_append(self):
+        segment = self.entries[-1][0] if self.entries else 0
+        while os.path.exists(self.segment_path(segment + 1)):
+            segment += 1
+        self._segment = segment
+        self._segment_file = open(self.segment_path(segment), 'ab')
+        self._index_file = open(self.index_path, 'ab')
+
+    def _record_index(self, height, segment, offset, length, header_length, tx_count, block_hash):
+        self.entries.append((segment, offset, length, header_length, tx_count, block_hash))
+        self.heights[block_hash] = height
+        record = INDEX_RECORD_FORMAT.pack(height, segment, offset, length, header_length, tx_count,
+                                          bytes.fromhex(block_hash))
+        if self._index_file is None:
+            # Still recovering, the index file is opened for append afterwards
+            with open(self.index_path, 'ab') as f:
+                f.write(record)
+        else:
+            self._index_file.write(record)
+
+    @staticmethod
+    def encode_payload(block):
+        header = {key: value for key, value in block.items() if key != 'transactions'}
+        header_bytes = encode_header(header)
+        body_bytes = encode_transactions(block['transactions'])
+        prefix = PAYLOAD_PREFIX_FORMAT.pack(len(header_bytes), len(block['transactions']))
+        return prefix + header_bytes + body_bytes, len(header_bytes)
+
+    def append(self, block, sync=True):
+        """Write one block as a framed record, returns its height"""
+        payload, header_length = self.encode_payload(block)
+        frame = FRAME_HEADER_FORMAT.pack(FRAME_MAGIC, len(payload), zlib.crc32(payload)) + payload
+
+        with self.lock:
+            if self._segment_file.tell() > 0 and self._segment_file.tell() + len(frame) > self.segment_size:
+                self._segment_file.close()
+                self._segment += 1
+                self._segment_file = open(self.segment_path(self._segment), 'ab')
+
+            offset = self._segment_file.tell()
+            self._segment_file.write(frame)
+            self._segment_file.flush()
+            if sync:
+                os.fsync(self._segment_file.fileno())
+
+            # The frame is durable before the index points at it
+            height = len(self.entries)
+            self._record_index(height, self._segment, offset, len(payload), header_length,
+                               len(block['transactions']), block['hash'])
+            self._index_file.flush()
+            return height
+
+    def import_json(self, legacy_path):
+        """One-off import of a chain kept in the old blockchain.json format"""
+        with open(legacy_path, 'r') as f:
+            blocks = json.load(f)
+        for block in blocks:
+            self.append(block, sync=False)
+        self.sync()
+        print(f"Imported {len(blocks)} blocks from {legacy_path}")
+
+    def reset(self, blocks):
+        """Replace the whole chain, e.g. with one received from the bootstrap node"""
+        with self.lock:
+            self.close()
+            for name in os.listdir(self.path):
+                if name.startswith('blk') or name in (INDEX_FILE, HEADERS_FILE):
+                    os.remove(os.path.join(self.path, name))
+            self.entries = []
+            self.heights = {}
+            self.pruned_height = 0
+            self._open_for_append()
+            for block in blocks:
+                self.append(block, sync=False)
+            self.sync()
+
+    def sync(self):
+        with self.lock:
+            self._segment_file.flush()
+            os.fsync(self._segment_file.fileno())
+            self._index_file.flush()
+            os.fsync(self._index_file.fileno())
+
+    def close(self):
+        with self.lock:
+            for view in self._maps.values():
+                view.close()
+            self._maps = {}
+            if self._segment_file is not None:
+                self._segment_file.close()
+            if self._index_file is not None:
+                self._index_file.close()
+            self._segment_file = None
+            self._index_file = None
+
+    # --- Pruning ---
+
+    def prune_height_limit(self):
+        """Height below which the keep policy allows bodies to go"""
+        if not self.pruning:
+            return 0
+
+        limits = []
+        if self.prune_keep_blocks is not None:
+            limits.append(len(self.entries) - max(self.prune_keep_blocks, 1))
+        if self.prune_keep_bytes is not None:
+            kept = 0
+            height = len(self.entries)
+            while height > self.pruned_height and kept < self.prune_keep_bytes:
+                height -= 1
+                kept += self.entries[height][2]
+            limits.append(height)
+        return max(min(limits), 0)
+
+    def prune(self, max_height):
+        """Drop the bodies of whole segments that lie below both max_height and the keep policy, returns how many"""
+        if not self.pruning:
+            return 0
+
+        with self.lock:
+            limit = min(max_height, self.prune_height_limit())
+            start = pruned_before = self.pruned_height
+            while start < limit:
+                segment = self.entries[start][0]
+                if segment == self._segment:
+                    break  # Still being appended to
+                end = start
+                while end < len(self.entries) and self.entries[end][0] == segment:
+                    end += 1
+                if end > limit:
+                    break
+                self._prune_segment(segment, start, end)
+                start = end
+            return self.pruned_height - pruned_before
+
+    def _prune_segment(self, segment, start, end):
+        # Headers first, then the index, then the segment, so a crash at any point leaves a usable store
+        records = []
+        with open(self.headers_path, 'ab') as f:
+            for height in range(start, end):
+                payload = encode_header(self.get_header(height))
+                records.append((height, f.tell(), len(payload)))
+                f.write(FRAME_HEADER_FORMAT.pack(HEADER_FRAME_MAGIC, len(payload), zlib.crc32(payload)) + payload)
+            f.flush()
+            os.fsync(f.fileno())
+
+        self._index_file.flush()
+        with open(self.index_path, 'r+b') as f:
+            for height, offset, length in records:
+                tx_count, block_hash = self.entries[height][4:]
+                self.entries[height] = (PRUNED_SEGMENT, offset, length, length, tx_count, block_hash)
+                f.seek(height * INDEX_RECORD_FORMAT.size)
+                f.write(INDEX_RECORD_FORMAT.pack(height, PRUNED_SEGMENT, offset, length, length, tx_count,
+                                                 bytes.fromhex(block_hash)))
+            f.flush()
+            os.fsync(f.fileno())
+
+        view = self._maps.pop(segment, None)
+        if view is not None:
+            view.close()
+        # The headers file grew, map it again on the next read
+        view = self._maps.pop(PRUNED_SEGMENT, None)
+        if view is not None:
+            view.close()
+        os.remove(self.segment_path(segment))
+        self.pruned_height = end
+        print(f"Pruned block bodies {start} to {end - 1}")
+
+    def has_body(self, height):
+        entry = self._entry(height)
+        return entry is not None and entry[0] != PRUNED_SEGMENT
+
+    # --- Reading ---
+
+    def _view(self, segment, end):
+        """Read-only map of a segment that reaches at least end, remapped once the segment has grown"""
+        view = self._maps.get(segment)
+        if view is None or len(view) < end:
+            if view is not None:
+                view.close()
+            if segment == self._segment:
+                self._segment_file.flush()
+            with open(self.segment_path(segment), 'rb') as f:
+                view = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[segment] = view
+        return view
+
+    def _entry(self, height):
+        if height < 0:
+            height += len(self.entries)
+        if height < 0 or height >= len(self.entries):
+            return None
+        return self.entries[height]
+
+    def _payload_slice(self, entry, start, end):
+        """Bytes [start, end) of the payload"""
+        segment, offset, length = entry[:3]
+        payload_start = offset + FRAME_HEADER_FORMAT.size
+        with self.lock:
+            view = self._view(segment, payload_start + length)
+            return view[payload_start + start:payload_start + end]
+
+    def get_block(self, height):
+        """Full block, None if there is no such height or its body was pruned"""
+        entry = self._entry(height)
+        if entry is None or entry[0] == PRUNED_SEGMENT:
+            return None
+
+        length, header_length = entry[2], entry[3]
+        payload = self._payload_slice(entry, 0, length)
+        start = PAYLOAD_PREFIX_FORMAT.size
+        block = decode_header(payload[start:start + header_length])
+        block['transactions'] = decode_transactions(payload[start + header_length:])
+        return block
+
+    def get_header(self, height):
+        """Block header without its transactions, slicing only the header bytes out of the map"""
+        entry = self._entry(height)
+        if entry is None:
+            return None
+
+        if entry[0] == PRUNED_SEGMENT:
+            return decode_header(self._payload_slice(entry, 0, entry[2]))
+
+        start = PAYLOAD_PREFIX_FORMAT.size
+        return decode_header(self._payload_slice(entry, start, start + entry[3]))
+
+    def get_tx_count(self, height):
+        entry = self._entry(height)
+        return entry[4] if entry else None
+
+    def get_block_by_hash(self, block_hash):
+        height = self.heights.get(block_hash)
+        if height is None:
+            return None
+        return self.get_block(height)
+
+    def get_height(self, block_hash):
+        return self.heights.get(block_hash)
+
+    def get_block_hash(self, height):
+        entry = self._entry(height)
+        return entry[5] if entry else None
+
+    def get_latest_block(self):
+        return self.get_block(-1)
+
+    def iter_blocks(self, start=0, end=None):
+        """Blocks by height, None in place of every pruned one"""
+        end = len(self.entries) if end is None else min(end, len(self.entries))
+        for height in range(max(start, 0), end):
+            yield self.get_block(height)
+
+    def iter_headers(self, start=0, end=None):
+        end = len(self.entries) if end is None else min(end, len(self.entries))
+        for height in range(max(start, 0), end):
+            yield self.get_header(height)
+
+    def get_blocks(self, start=0, end=None):
+        return list(self.iter_blocks(start, end))
@@ -0,0 +1,345 @@
+import json
+import struct
+
+# Compact binary form of blocks and transactions. Every encoded record starts with the codec version,
+# digests, keys and signatures are raw bytes and integers are varints.
+CODEC_VERSION = 1
+
+# Record kinds
+TRANSACTION = 0
+COINBASE = 1
+HEADER = 2
+BLOCK = 3
+FEE_TRANSACTION = 4
+MULTI_TRANSACTION = 5
+RAW_JSON = 255  # Anything that does not fit a known layout, kept as-is so decoding is always lossless
+
+# Numbers keep the int/float distinction of the JSON form
+NUMBER_INT = 0
+NUMBER_FLOAT = 1
+NUMBER_NONE = 2
+FLOAT_FORMAT = struct.Struct('>d')
+
+# Hex strings become raw bytes, other strings (e.g. the 'coinbase' signature) are kept as text
+FIELD_NONE = 0
+FIELD_HEX = 1
+FIELD_TEXT = 2
+
+TRANSACTION_KEYS = ('index', 'tx_hash', 'sender', 'recipient', 'amount', 'signature', 'sender_public_key')
+FEE_TRANSACTION_KEYS = TRANSACTION_KEYS + ('fee',)
+MULTI_TRANSACTION_KEYS = ('version', 'index', 'tx_hash', 'sender', 'outputs', 'signature', 'sender_public_key', 'fee')
+OUTPUT_KEYS = ('recipient', 'amount')
+COINBASE_KEYS = ('recipient', 'amount', 'block_height', 'tx_hash', 'version')
+HEADER_KEYS = ('version', 'index', 'previous_hash', 'merkle_root', 'nonce', 'difficulty', 'hash')
+TARGET_HEADER_KEYS = HEADER_KEYS + ('timestamp', 'bits')
+
+HEX_DIGITS = frozenset('0123456789abcdef')
+
+
+class CodecError(ValueError):
+    pass
+
+
+# --- Primitives ---
+
+def write_varint(out, value):
+    """Unsigned LEB128"""
+    if value < 0:
+        raise CodecError(f"varint can not hold {value}")
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data, offset):
+    value = 0
+    shift = 0
+    while True:
+        if offset >= len(data):
+            raise CodecError("truncated varint")
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def write_number(out, value):
+    if value is None:
+        out.append(NUMBER_NONE)
+    elif type(value) is int:
+        out.append(NUMBER_INT)
+        write_varint(out, value * 2 if value >= 0 else -value * 2 - 1)  # zigzag
+    elif type(value) is float:
+        out.append(NUMBER_FLOAT)
+        out += FLOAT_FORMAT.pack(value)
+    else:
+        raise CodecError(f"not a number: {value!r}")
+
+
+def read_number(data, offset):
+    tag = data[offset]
+    offset += 1
+    if tag == NUMBER_NONE:
+        return None, offset
+    if tag == NUMBER_INT:
+        value, offset = read_varint(data, offset)
+        return (value >> 1) ^ -(value & 1), offset
+    if tag == NUMBER_FLOAT:
+        return FLOAT_FORMAT.unpack_from(data, offset)[0], offset + FLOAT_FORMAT.size
+    raise CodecError(f"unknown number tag {tag}")
+
+
+def write_bytes(out, value):
+    write_varint(out, len(value))
+    out += value
+
+
+def read_bytes(data, offset):
+    length, offset = read_varint(data, offset)
+    end = offset + length
+    if end > len(data):
+        raise CodecError("truncated field")
+    return bytes(data[offset:end]), end
+
+
+def write_field(out, value):
+    """Optional string field, stored as raw bytes when it is lowercase hex"""
+    if value is None:
+        out.append(FIELD_NONE)
+    elif type(value) is not str:
+        raise CodecError(f"not a string: {value!r}")
+    elif value and len(value) % 2 == 0 and HEX_DIGITS.issuperset(value):
+        out.append(FIELD_HEX)
+        write_bytes(out, bytes.fromhex(value))
+    else:
+        out.append(FIELD_TEXT)
+        write_bytes(out, value.encode())
+
+
+def read_field(data, offset):
+    tag = data[offset]
+    offset += 1
+    if tag == FIELD_NONE:
+        return None, offset
+    value, offset = read_bytes(data, offset)
+    if tag == FIELD_HEX:
+        return value.hex(), offset
+    if tag == FIELD_TEXT:
+        return value.decode(), offset
+    raise CodecError(f"unknown field tag {tag}")
+
+
+# --- Records ---
+
+def _write_transaction(out, tx):
+    keys = tuple(tx)
+    if keys in (TRANSACTION_KEYS, FEE_TRANSACTION_KEYS):
+        start = len(out)
+        try:
+            out.append(TRANSACTION if keys == TRANSACTION_KEYS else FEE_TRANSACTION)
+            write_number(out, tx['index'])
+            write_field(out, tx['tx_hash'])
+            write_field(out, tx['sender'])
+            write_field(out, tx['recipient'])
+            write_number(out, tx['amount'])
+            write_field(out, tx['signature'])
+            write_field(out, tx['sender_public_key'])
+            if keys == FEE_TRANSACTION_KEYS:
+                write_number(out, tx['fee'])
+            return
+        except CodecError:
+            del out[start:]
+    elif keys == MULTI_TRANSACTION_KEYS:
+        start = len(out)
+        try:
+            out.append(MULTI_TRANSACTION)
+            write_number(out, tx['version'])
+            write_number(out, tx['index'])
+            write_field(out, tx['tx_hash'])
+            write_field(out, tx['sender'])
+            write_varint(out, len(tx['outputs']))
+            for output in tx['outputs']:
+                if tuple(output) != OUTPUT_KEYS:
+                    raise CodecError(f"unknown output layout {tuple(output)}")
+                write_field(out, output['recipient'])
+                write_number(out, output['amount'])
+            write_field(out, tx['signature'])
+            write_field(out, tx['sender_public_key'])
+            write_number(out, tx['fee'])
+            return
+        except (CodecError, TypeError):
+            del out[start:]
+    elif keys == COINBASE_KEYS:
+        start = len(out)
+        try:
+            out.append(COINBASE)
+            write_field(out, tx['recipient'])
+            write_number(out, tx['amount'])
+            write_number(out, tx['block_height'])
+            write_field(out, tx['tx_hash'])
+            write_number(out, tx['version'])
+            return
+        except CodecError:
+            del out[start:]
+
+    out.append(RAW_JSON)
+    write_bytes(out, json.dumps(tx, separators=(',', ':')).encode())
+
+
+def _read_transaction(data, offset):
+    kind = data[offset]
+    offset += 1
+    if kind in (TRANSACTION, FEE_TRANSACTION):
+        keys = TRANSACTION_KEYS if kind == TRANSACTION else FEE_TRANSACTION_KEYS
+        values = []
+        for reader in (read_number, read_field, read_field, read_field, read_number, read_field, read_field,
+                       read_number)[:len(keys)]:
+            value, offset = reader(data, offset)
+            values.append(value)
+        return dict(zip(keys, values)), offset
+    if kind == MULTI_TRANSACTION:
+        version, offset = read_number(data, offset)
+        index, offset = read_number(data, offset)
+        tx_hash, offset = read_field(data, offset)
+        sender, offset = read_field(data, offset)
+        count, offset = read_varint(data, offset)
+        outputs = []
+        for _ in range(count):
+            recipient, offset = read_field(data, offset)
+            amount, offset = read_number(data, offset)
+            outputs.append({'recipient': recipient, 'amount': amount})
+        signature, offset = read_field(data, offset)
+        public_key, offset = read_field(data, offset)
+        fee, offset = read_number(data, offset)
+        return dict(zip(MULTI_TRANSACTION_KEYS, (version, index, tx_hash, sender, outputs, signature, public_key,
+                                                 fee))), offset
+    if kind == COINBASE:
+        values = []
+        for reader in (read_field, read_number, read_number, read_field, read_number):
+            value, offset = reader(data, offset)
+            values.append(value)
+        return dict(zip(COINBASE_KEYS, values)), offset
+    if kind == RAW_JSON:
+        raw, offset = read_bytes(data, offset)
+        return json.loads(raw), offset
+    raise CodecError(f"unknown transaction kind {kind}")
+
+
+def _write_header(out, header):
+    keys = tuple(header)
+    if keys in (HEADER_KEYS, TARGET_HEADER_KEYS):
+        start = len(out)
+        try:
+            out.append(HEADER)
+            out.append(len(keys) == len(TARGET_HEADER_KEYS))
+            write_number(out, header['version'])
+            write_number(out, header['index'])
+            write_field(out, header['previous_hash'])
+            write_field(out, header['merkle_root'])
+            write_number(out, header['nonce'])
+            write_number(out, header['difficulty'])
+            write_field(out, header['hash'])
+            if len(keys) == len(TARGET_HEADER_KEYS):
+                write_number(out, header['timestamp'])
+                write_number(out, header['bits'])
+            return
+        except CodecError:
+            del out[start:]
+
+    out.append(RAW_JSON)
+    write_bytes(out, json.dumps(header, separators=(',', ':')).encode())
+
+
+def _read_header(data, offset):
+    kind = data[offset]
+    offset += 1
+    if kind == RAW_JSON:
+        raw, offset = read_bytes(data, offset)
+        return json.loads(raw), offset
+    if kind != HEADER:
+        raise CodecError(f"unknown header kind {kind}")
+
+    keys = TARGET_HEADER_KEYS if data[offset] else HEADER_KEYS
+    offset += 1
+    readers = (read_number, read_number, read_field, read_field, read_number, read_number, read_field,
+               read_number, read_number)
+    values = []
+    for reader in readers[:len(keys)]:
+        value, offset = reader(data, offset)
+        values.append(value)
+    return dict(zip(keys, values)), offset
+
+
+def _check_version(data):
+    if not data or data[0] != CODEC_VERSION:
+        raise CodecError(f"unsupported codec version {data[0] if data else None}")
+
+
+# --- Public API, all of it works on the to_dict form ---
+
+def encode_transaction(tx_dict):
+    out = bytearray([CODEC_VERSION])
+    _write_transaction(out, tx_dict)
+    return bytes(out)
+
+
+def decode_transaction(data):
+    _check_version(data)
+    return _read_transaction(data, 1)[0]
+
+
+def encode_transactions(tx_dicts):
+    """A block body: count followed by the transactions"""
+    out = bytearray([CODEC_VERSION])
+    write_varint(out, len(tx_dicts))
+    for tx in tx_dicts:
+        _write_transaction(out, tx)
+    return bytes(out)
+
+
+def decode_transactions(data):
+    _check_version(data)
+    count, offset = read_varint(data, 1)
+    transactions = []
+    for _ in range(count):
+        tx, offset = _read_transaction(data, offset)
+        transactions.append(tx)
+    return transactions
+
+
+def encode_header(header):
+    out = bytearray([CODEC_VERSION])
+    _write_header(out, header)
+    return bytes(out)
+
+
+def decode_header(data):
+    _check_version(data)
+    return _read_header(data, 1)[0]
+
+
+def encode_block(block):
+    header = {key: value for key, value in block.items() if key != 'transactions'}
+    out = bytearray([CODEC_VERSION, BLOCK])
+    _write_header(out, header)
+    write_varint(out, len(block['transactions']))
+    for tx in block['transactions']:
+        _write_transaction(out, tx)
+    return bytes(out)
+
+
+def decode_block(data):
+    _check_version(data)
+    if data[1] != BLOCK:
+        raise CodecError(f"not a block record: kind {data[1]}")
+    block, offset = _read_header(data, 2)
+    count, offset = read_varint(data, offset)
+    transactions = []
+    for _ in range(count):
+        tx, offset = _read_transaction(data, offset)
+        transactions.append(tx)
+    block['transactions'] = transactions
+    return block
@@ -0,0 +1,120 @@
+import ecdsa
+from ecdsa.ellipticcurve import PointJacobi
+
+try:
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.hazmat.primitives.asymmetric.utils import decode_dss_signature, encode_dss_signature
+except ImportError:
+    ec = None
+
+# secp256k1 keys and signatures as the chain stores them: 32-byte private keys, 64-byte x||y public keys and
+# 64-byte r||s signatures over the SHA-1 digest of the data (the python-ecdsa defaults the chain started with)
+CURVE = ecdsa.SECP256k1
+COORDINATE_SIZE = 32
+
+# None picks the fastest backend that is importable, or force one by name
+CRYPTO_BACKEND = None
+
+
+class EcdsaBackend:
+    """Pure-Python python-ecdsa, always available"""
+
+    name = 'ecdsa'
+
+    def generate_private_key(self):
+        return ecdsa.SigningKey.generate(curve=CURVE).to_string()
+
+    def load_private_key(self, private_key_bytes):
+        return ecdsa.SigningKey.from_string(private_key_bytes, curve=CURVE)
+
+    def public_key_bytes(self, private_key):
+        return private_key.verifying_key.to_string()
+
+    def sign(self, private_key, data):
+        return private_key.sign(data)
+
+    def load_public_key(self, public_key_bytes):
+        return ecdsa.VerifyingKey.from_string(public_key_bytes, curve=CURVE)
+
+    def prepare_hot_key(self, public_key):
+        """Copy of the key with its point tables built; the parsed point does not carry the order they need"""
+        point = public_key.pubkey.point
+        point = PointJacobi(CURVE.curve, point.x(), point.y(), 1, CURVE.order, generator=True)
+        hot_key = ecdsa.VerifyingKey.from_public_point(point, curve=CURVE)
+        hot_key.precompute()
+        return hot_key
+
+    def verify(self, public_key, signature, data):
+        try:
+            return public_key.verify(signature, data)
+        except ecdsa.BadSignatureError:
+            return False
+
+
+class CryptographyBackend:
+    """OpenSSL through the cryptography package, same key and signature encodings as EcdsaBackend"""
+
+    name = 'cryptography'
+
+    def __init__(self):
+        self.curve = ec.SECP256K1()
+        self.algorithm = ec.ECDSA(hashes.SHA1())
+
+    def generate_private_key(self):
+        return ec.generate_private_key(self.curve).private_numbers().private_value.to_bytes(COORDINATE_SIZE, 'big')
+
+    def load_private_key(self, private_key_bytes):
+        return ec.derive_private_key(int.from_bytes(private_key_bytes, 'big'), self.curve)
+
+    def public_key_bytes(self, private_key):
+        numbers = private_key.public_key().public_numbers()
+        return numbers.x.to_bytes(COORDINATE_SIZE, 'big') + numbers.y.to_bytes(COORDINATE_SIZE, 'big')
+
+    def sign(self, private_key, data):
+        r, s = decode_dss_signature(private_key.sign(data, self.algorithm))
+        return r.to_bytes(COORDINATE_SIZE, 'big') + s.to_bytes(COORDINATE_SIZE, 'big')
+
+    def load_public_key(self, public_key_bytes):
+        if len(public_key_bytes) != 2 * COORDINATE_SIZE:
+            raise ValueError(f"public key must be {2 * COORDINATE_SIZE} bytes")
+        return ec.EllipticCurvePublicKey.from_encoded_point(self.curve, b'\x04' + public_key_bytes)
+
+    def prepare_hot_key(self, public_key):
+        # OpenSSL keeps its own tables
+        return public_key
+
+    def verify(self, public_key, signature, data):
+        if len(signature) != 2 * COORDINATE_SIZE:
+            return False
+        r = int.from_bytes(signature[:COORDINATE_SIZE], 'big')
+        s = int.from_bytes(signature[COORDINATE_SIZE:], 'big')
+        try:
+            public_key.verify(encode_dss_signature(r, s), data, self.algorithm)
+            return True
+        except (InvalidSignature, ValueError):
+            return False
+
+
+BACKENDS = {
+    'cryptography': CryptographyBackend,
+    'ecdsa': EcdsaBackend,
+}
+
+
+def available_backends():
+    """Names of the backends that can be used here, fastest first"""
+    return [name for name in BACKENDS if name != 'cryptography' or ec is not None]
+
+
+def get_backend(name=None):
+    if name is None:
+        name = available_backends()[0]
+    if name not in available_backends():
+        raise ValueError(f"crypto backend {name} is not available, use one of {available_backends()}")
+    return BACKENDS[name]()
+
+
+# The one every key and signature in this process goes through
+backend = get_backend(CRYPTO_BACKEND)
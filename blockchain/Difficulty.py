@@ -0,0 +1,110 @@
+import time
+
+# Target for blocks mined before version 4: two leading zero hex digits in the hash
+LEGACY_TARGET = 16 ** 62 - 1
+
+# Easiest target a block may ever use
+POW_LIMIT = LEGACY_TARGET
+
+# Seconds we want between blocks, and how many recent blocks the retarget averages over
+TARGET_BLOCK_INTERVAL = 60
+RETARGET_WINDOW = 10
+
+# One retarget may move the target by at most this factor either way
+MAX_ADJUSTMENT = 4
+
+# Blocks may not claim a timestamp further than this many seconds ahead of our clock
+MAX_FUTURE_BLOCK_TIME = 2 * 60 * 60
+
+
+def target_to_bits(target):
+    """Compact 32-bit form of a target: 1 byte size followed by a 3 byte mantissa"""
+    size = (target.bit_length() + 7) // 8
+    if size <= 3:
+        mantissa = target << (8 * (3 - size))
+    else:
+        mantissa = target >> (8 * (size - 3))
+
+    # The mantissa's top bit is a sign bit, keep it clear
+    if mantissa & 0x00800000:
+        mantissa >>= 8
+        size += 1
+    return (size << 24) | mantissa
+
+
+def bits_to_target(bits):
+    size = bits >> 24
+    mantissa = bits & 0x007fffff
+    if size <= 3:
+        return mantissa >> (8 * (3 - size))
+    return mantissa << (8 * (size - 3))
+
+
+POW_LIMIT_BITS = target_to_bits(POW_LIMIT)
+
+
+def block_target(block):
+    """Target a block dict was mined against"""
+    if 'bits' in block:
+        return bits_to_target(block['bits'])
+    return LEGACY_TARGET
+
+
+def meets_target(block_hash, target):
+    return int(block_hash, 16) <= target
+
+
+def difficulty_from_target(target):
+    """How many times harder than the legacy two-zero difficulty a target is"""
+    return LEGACY_TARGET / target
+
+
+def next_bits(recent_blocks, target_interval=TARGET_BLOCK_INTERVAL, window=RETARGET_WINDOW):
+    """Bits for the block after recent_blocks, which only needs the last window + 1 blocks"""
+    timed_blocks = [block for block in recent_blocks[-(window + 1):] if 'timestamp' in block]
+    if len(timed_blocks) < 2:
+        # Nothing to measure yet, start from the easiest target
+        if recent_blocks and 'bits' in recent_blocks[-1]:
+            return recent_blocks[-1]['bits']
+        return POW_LIMIT_BITS
+
+    intervals = len(timed_blocks) - 1
+    actual_timespan = timed_blocks[-1]['timestamp'] - timed_blocks[0]['timestamp']
+    expected_timespan = intervals * target_interval
+
+    # Clamp so a burst of odd timestamps cannot swing the difficulty too far
+    actual_timespan = max(actual_timespan, expected_timespan // MAX_ADJUSTMENT)
+    actual_timespan = min(actual_timespan, expected_timespan * MAX_ADJUSTMENT)
+
+    average_target = sum(block_target(block) for block in timed_blocks[1:]) // intervals
+    new_target = average_target * actual_timespan // expected_timespan
+    new_target = max(1, min(new_target, POW_LIMIT))
+    return target_to_bits(new_target)
+
+
+def median_time_past(recent_blocks):
+    """Median timestamp of the last 11 blocks, None before any block carried one"""
+    recent_timestamps = sorted(block['timestamp'] for block in recent_blocks[-11:] if 'timestamp' in block)
+    if not recent_timestamps:
+        return None
+    return recent_timestamps[len(recent_timestamps) // 2]
+
+
+def next_timestamp(recent_blocks):
+    """Timestamp for a new block: now, but always past the median of recent blocks"""
+    now = int(time.time())
+    median = median_time_past(recent_blocks)
+    if median is not None and now <= median:
+        return median + 1
+    return now
+
+
+def verify_timestamp(block, recent_blocks):
+    """Timestamps must move past the median of recent blocks and not run ahead of our clock"""
+    if block['timestamp'] > time.time() + MAX_FUTURE_BLOCK_TIME:
+        return False
+
+    median = median_time_past(recent_blocks)
+    if median is not None and block['timestamp'] <= median:
+        return False
+    return True
@@ -0,0 +1,210 @@
+import hashlib
+import hmac
+import json
+import os
+
+from .Crypto import CURVE, backend
+from .Wallet import WalletSession, address_from_public_key
+from .Workers import process_context
+
+# BIP32-style derivation, hardened only: a child needs its parent's private key and chain code, no point maths
+MASTER_HMAC_KEY = b'Bitcoin seed'
+HARDENED = 0x80000000
+SEED_SIZE = 32
+
+# Below this many keys a bulk derivation is not worth starting worker processes for
+MIN_PARALLEL_DERIVE = 256
+
+
+def master_node(seed):
+    digest = hmac.new(MASTER_HMAC_KEY, seed, hashlib.sha512).digest()
+    return digest[:32], digest[32:]
+
+
+def derive_child(node, index):
+    """Hardened child (private key, chain code) of a node"""
+    key, chain_code = node
+    data = b'\x00' + key + (index | HARDENED).to_bytes(4, 'big')
+    digest = hmac.new(chain_code, data, hashlib.sha512).digest()
+    tweak = int.from_bytes(digest[:32], 'big')
+    child = (tweak + int.from_bytes(key, 'big')) % CURVE.order
+    if tweak >= CURVE.order or child == 0:
+        # Happens with probability below 2^-127. BIP32 would skip to the next index, addresses here stay contiguous
+        raise ValueError(f"child {index} is not a valid key")
+    return child.to_bytes(32, 'big'), digest[32:]
+
+
+def fingerprint(account_node):
+    """Short hash of the account's public key, ties the address log to the seed it was derived from"""
+    public_key_bytes = backend.public_key_bytes(backend.load_private_key(account_node[0]))
+    return hashlib.sha256(public_key_bytes).hexdigest()[:16]
+
+
+def derive_keys(account_node, start, end):
+    """(index, address, public key hex) for children start..end-1 of the account node"""
+    keys = []
+    for index in range(start, end):
+        private_key_bytes = derive_child(account_node, index)[0]
+        public_key_bytes = backend.public_key_bytes(backend.load_private_key(private_key_bytes))
+        keys.append((index, address_from_public_key(public_key_bytes), public_key_bytes.hex()))
+    return keys
+
+
+def _derive_keys_job(job):
+    return derive_keys(*job)
+
+
+class Keystore:
+    """Any number of addresses derived from one seed as m/account'/i', with an address -> path lookup
+
+    Only the seed needs backing up. Derived addresses and public keys are kept in an append-only log so
+    startup does not derive them again; private keys are derived again whenever one is needed to sign.
+    """
+
+    def __init__(self, path='my_data/Wallets/keystore.json', index_path='my_data/Wallets/keystore_addresses.log',
+                 account=0, seed_hex=None):
+        self.path = path
+        self.index_path = index_path
+        self.account = account
+
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                data = json.load(f)
+            if seed_hex is not None and seed_hex != data['Seed']:
+                raise ValueError(f"{path} already holds a different seed")
+            self.seed_hex = data['Seed']
+            self.count = data['Count']
+            self.account_node = derive_child(master_node(bytes.fromhex(self.seed_hex)), account)
+            self.fingerprint = fingerprint(self.account_node)
+            if data.get('Fingerprint', self.fingerprint) != self.fingerprint:
+                raise ValueError(f"{path} is corrupt, its seed does not match its fingerprint")
+        else:
+            # A new keystore, or one restored from its backed up seed
+            self.seed_hex = seed_hex if seed_hex is not None else os.urandom(SEED_SIZE).hex()
+            self.count = 0
+            self.account_node = derive_child(master_node(bytes.fromhex(self.seed_hex)), account)
+            self.fingerprint = fingerprint(self.account_node)
+            self.save()
+
+        self.addresses = {}  # address -> index
+        self.public_keys = []  # index -> public key hex
+        self._file = None
+        self._load_index()
+
+    def __len__(self):
+        return len(self.public_keys)
+
+    def __contains__(self, address):
+        return address in self.addresses
+
+    def save(self):
+        data = {'Seed': self.seed_hex, 'Count': self.count, 'Fingerprint': self.fingerprint}
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(temp_path, self.path)
+
+    def _load_index(self):
+        """Read the address log up to its first torn or out-of-order line, then derive whatever it is missing
+
+        The log starts with the fingerprint of the seed it belongs to. One left behind by another seed is
+        discarded rather than trusted.
+        """
+        header = f"# keystore {self.fingerprint}\n".encode()
+        valid_size = 0
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'rb') as f:
+                first_line = f.readline()
+                if first_line == header:
+                    valid_size = len(header)
+                else:
+                    if first_line.endswith(b'\n'):
+                        print(f"Keystore address log {self.index_path} belongs to another seed, deriving it again")
+                    f.seek(0, os.SEEK_END)  # Keep nothing
+                for line in f:
+                    parts = line.decode(errors='replace').split()
+                    if not line.endswith(b'\n') or len(parts) != 3 or parts[0] != str(len(self.public_keys)):
+                        break
+                    self.addresses[parts[1]] = len(self.public_keys)
+                    self.public_keys.append(parts[2])
+                    valid_size += len(line)
+
+            if os.path.getsize(self.index_path) != valid_size:
+                if valid_size:
+                    print(f"Keystore address log {self.index_path} has a torn entry at {valid_size}, truncating it")
+                with open(self.index_path, 'r+b') as f:
+                    f.truncate(valid_size)
+
+        self._file = open(self.index_path, 'a')
+        if not valid_size:
+            self._file.write(header.decode())
+            self._file.flush()
+        if len(self.public_keys) < self.count:
+            self._append(derive_keys(self.account_node, len(self.public_keys), self.count))
+
+    def _append(self, keys):
+        lines = []
+        for index, address, public_key_hex in keys:
+            self.addresses[address] = index
+            self.public_keys.append(public_key_hex)
+            lines.append(f"{index} {address} {public_key_hex}\n")
+        self._file.write(''.join(lines))
+        self._file.flush()
+
+    # --- Derivation ---
+
+    def derive_addresses(self, count, workers=1):
+        """Derive the next count addresses, spread over a process pool when workers > 1, and return them"""
+        start = len(self.public_keys)
+        end = start + count
+        if workers > 1 and count >= MIN_PARALLEL_DERIVE:
+            chunk_size = -(-count // (workers * 4))
+            jobs = [(self.account_node, chunk_start, min(chunk_start + chunk_size, end))
+                    for chunk_start in range(start, end, chunk_size)]
+            context = process_context()
+            with context.Pool(workers) as pool:
+                keys = [key for chunk in pool.map(_derive_keys_job, jobs) for key in chunk]
+        else:
+            keys = derive_keys(self.account_node, start, end)
+
+        self._append(keys)
+        self.count = len(self.public_keys)
+        self.save()
+        return [address for _, address, _ in keys]
+
+    def new_address(self):
+        return self.derive_addresses(1)[0]
+
+    def address_at(self, index):
+        """Address of child index, deriving it (and any before it) on first use"""
+        if index >= len(self.public_keys):
+            self.derive_addresses(index + 1 - len(self.public_keys))
+        return address_from_public_key(bytes.fromhex(self.public_keys[index]))
+
+    # --- Lookup ---
+
+    def path_of_index(self, index):
+        return f"m/{self.account}'/{index}'"
+
+    def index_of(self, address):
+        """Which child owns the address, None if it is not one of ours"""
+        return self.addresses.get(address)
+
+    def derivation_path(self, address):
+        index = self.addresses.get(address)
+        return self.path_of_index(index) if index is not None else None
+
+    def private_key_hex(self, index):
+        return derive_child(self.account_node, index)[0].hex()
+
+    def session(self, address):
+        """WalletSession signing for one of our addresses"""
+        index = self.addresses.get(address)
+        if index is None:
+            raise KeyError(f"{address} is not derived from this keystore")
+        return WalletSession(address, self.public_keys[index], self.private_key_hex(index))
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,94 @@
+from Transactions import transaction_fee, transaction_outputs, transaction_total
+
+from .Snapshot import SnapshotStore
+
+
+class Ledger:
+    """Account balances kept up to date block by block, plus an overlay for pending transactions"""
+
+    def __init__(self, path='my_data/snapshots'):
+        self.snapshots = SnapshotStore(path)
+        self.balances = {}  # address -> confirmed balance
+        self.pending = {}  # address -> change from pending transactions
+        self.height = 0  # Number of blocks applied
+        self.tip_hash = None
+        self.snapshot_height = 0  # Height of the newest snapshot written or loaded
+
+    @staticmethod
+    def apply_transaction(balances, transaction, sign=1):
+        # Coinbase transactions have no sender, coins are created
+        for recipient, amount in transaction_outputs(transaction):
+            balances[recipient] = balances.get(recipient, 0) + sign * amount
+
+        # The sender also pays the fee, which the miner collects through the coinbase
+        sender = transaction.get('sender')
+        if sender:
+            spent = transaction_total(transaction) + transaction_fee(transaction)
+            balances[sender] = balances.get(sender, 0) - sign * spent
+
+    @classmethod
+    def block_changes(cls, block):
+        """Balance change per address of a block, raises on a malformed transaction before any balance moves"""
+        changes = {}
+        for transaction in block['transactions']:
+            cls.apply_transaction(changes, transaction)
+        return changes
+
+    def connect_block(self, block, changes=None):
+        if changes is None:
+            changes = self.block_changes(block)
+        for address, change in changes.items():
+            self.balances[address] = self.balances.get(address, 0) + change
+        self.height += 1
+        self.tip_hash = block['hash']
+
+    def add_pending(self, transaction):
+        self.apply_transaction(self.pending, transaction)
+
+    def remove_pending(self, transactions):
+        for transaction in transactions:
+            self.apply_transaction(self.pending, transaction, sign=-1)
+
+    def set_pending(self, transactions):
+        self.pending = {}
+        for transaction in transactions:
+            self.add_pending(transaction)
+
+    def get_balance(self, address, include_pending=True):
+        balance = self.balances.get(address, 0)
+        if include_pending:
+            balance += self.pending.get(address, 0)
+        return balance
+
+    def sync(self, store):
+        """Start from the newest snapshot that fits the chain and replay only the blocks after it, returns how many"""
+        self.balances, self.height, self.tip_hash, self.snapshot_height = {}, 0, None, 0
+        snapshot = self.snapshots.load_latest(store)
+        if snapshot is not None:
+            self.balances = snapshot['state']['balances']
+            self.height = self.snapshot_height = snapshot['height']
+            self.tip_hash = snapshot['tip_hash']
+        elif len(store):
+            print("No state snapshot matches the chain, replaying every block")
+
+        if self.height < store.pruned_height:
+            raise RuntimeError(f"Block bodies below height {store.pruned_height} are pruned and no state snapshot "
+                               f"covers them, resync the chain from a peer")
+        for block in store.iter_blocks(self.height):
+            self.connect_block(block)
+        return self.height - self.snapshot_height
+
+    def rebuild(self, store):
+        if store.pruned_height:
+            raise RuntimeError("Can not rebuild balances from a pruned chain")
+        self.snapshots.clear()
+        self.balances, self.height, self.tip_hash, self.snapshot_height = {}, 0, None, 0
+        for block in store.iter_blocks():
+            self.connect_block(block)
+        self.save()
+
+    def save(self):
+        if not self.height:
+            return
+        self.snapshots.write(self.height, self.tip_hash, {'balances': self.balances})
+        self.snapshot_height = self.height
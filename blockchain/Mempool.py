@@ -0,0 +1,247 @@
+import heapq
+import threading
+import time
+
+from Transactions import transaction_fee
+
+from .Codec import encode_transaction
+
+# Limits for the pool as a whole, past them the lowest fee-rate transactions are evicted
+MEMPOOL_MAX_COUNT = 5000
+MEMPOOL_MAX_BYTES = 5 * 1024 * 1024
+
+# Transactions still pending after this many seconds are dropped
+MEMPOOL_EXPIRY = 72 * 60 * 60
+
+
+def transaction_size(tx_dict):
+    """Bytes the transaction takes in a block, as written by the binary codec"""
+    return len(encode_transaction(tx_dict))
+
+
+def fee_rate(tx_dict, size):
+    return transaction_fee(tx_dict) / size
+
+
+class Mempool:
+    """The one in-memory view of pending transactions, indexed by tx_hash and sender; the pool only persists it
+
+    The mempool is bounded by count and bytes. When full, a newcomer evicts the lowest fee-rate entries if it
+    pays a higher rate than they do, and entries older than expiry seconds are dropped.
+    """
+
+    def __init__(self, pool, max_count=MEMPOOL_MAX_COUNT, max_bytes=MEMPOOL_MAX_BYTES, expiry=MEMPOOL_EXPIRY):
+        self.pool = pool  # PendingPool or SQLitePendingPool
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.expiry = expiry
+        self.lock = threading.RLock()
+        # Called under the lock with each transaction admitted, and with the ones that leave the pool, e.g. to
+        # keep pending balances in step with exactly what is pending
+        self.on_add = None
+        self.on_remove = None
+
+        self.transactions = {}  # tx_hash -> transaction dict, in arrival order
+        self.by_sender = {}  # sender -> {tx_hash: None}, in arrival order
+        self.entries = {}  # tx_hash -> (fee rate, size, arrival time)
+        self.total_bytes = 0
+        # (fee rate, arrival sequence, tx_hash), entries that left the pool are skipped when popped
+        self._by_fee_rate = []
+        self._sequence = 0
+
+        # Arrival times are not persisted, reloaded transactions get a fresh expiry
+        for tx_dict in pool.load():
+            self._insert(tx_dict, transaction_size(tx_dict), time.time())
+
+        # The limits may have been lowered since the pool was written
+        with self.lock:
+            self._evict(0, 0)
+        # The pool compacts its log from what is pending here
+        pool.live_transactions = self.load
+
+    def __len__(self):
+        return len(self.transactions)
+
+    def __contains__(self, tx_hash):
+        return tx_hash in self.transactions
+
+    def _insert(self, tx_dict, size, arrival):
+        tx_hash = tx_dict['tx_hash']
+        if tx_hash in self.transactions:
+            return False
+        rate = fee_rate(tx_dict, size)
+        self.transactions[tx_hash] = tx_dict
+        self.entries[tx_hash] = (rate, size, arrival)
+        self.total_bytes += size
+        sender = tx_dict.get('sender')
+        if sender:
+            self.by_sender.setdefault(sender, {})[tx_hash] = None
+        self._sequence += 1
+        heapq.heappush(self._by_fee_rate, (rate, self._sequence, tx_hash))
+        return True
+
+    def _discard(self, tx_hash):
+        tx_dict = self.transactions.pop(tx_hash, None)
+        if tx_dict is None:
+            return None
+        self.total_bytes -= self.entries.pop(tx_hash)[1]
+        sender = tx_dict.get('sender')
+        if sender:
+            hashes = self.by_sender[sender]
+            del hashes[tx_hash]
+            if not hashes:
+                del self.by_sender[sender]
+        return tx_dict
+
+    def _lowest_fee_rate(self):
+        """Lowest fee-rate entry still in the pool, as (rate, tx_hash)"""
+        while self._by_fee_rate:
+            rate, _, tx_hash = self._by_fee_rate[0]
+            if tx_hash in self.transactions:
+                return rate, tx_hash
+            heapq.heappop(self._by_fee_rate)
+        return None
+
+    def _is_full(self, extra_count, extra_bytes):
+        return (len(self.transactions) + extra_count > self.max_count or
+                self.total_bytes + extra_bytes > self.max_bytes)
+
+    def _evict(self, extra_count, extra_bytes, below_rate=None):
+        """Evict lowest fee-rate entries until extra_count/extra_bytes more fit, returns the hashes evicted
+
+        With below_rate set only entries paying less than it may go, returns None if that is not enough.
+        """
+        popped = []
+        count, size = len(self.transactions), self.total_bytes
+        while count + extra_count > self.max_count or size + extra_bytes > self.max_bytes:
+            lowest = self._lowest_fee_rate()
+            if lowest is None or (below_rate is not None and lowest[0] >= below_rate):
+                # Not enough room can be made, leave the pool as it was
+                for item in popped:
+                    heapq.heappush(self._by_fee_rate, item)
+                return None
+            item = heapq.heappop(self._by_fee_rate)
+            popped.append(item)
+            count -= 1
+            size -= self.entries[item[2]][1]
+
+        victims = [item[2] for item in popped]
+        if victims:
+            self._remove(victims)
+            print(f"Evicted {len(victims)} lowest fee-rate transactions from the mempool")
+        return victims
+
+    def expire(self, now=None):
+        """Drop transactions that have been pending longer than expiry, returns how many"""
+        with self.lock:
+            count, sequence = self._expire(now)
+        self.pool.wait(sequence)
+        return count
+
+    def _expire(self, now=None):
+        """expire() for callers holding the lock, returns (how many, pool sequence number to wait for)"""
+        now = time.time() if now is None else now
+        expired = []
+        # Arrival order, so the oldest are first
+        for tx_hash in self.transactions:
+            if now - self.entries[tx_hash][2] < self.expiry:
+                break
+            expired.append(tx_hash)
+        sequence = None
+        if expired:
+            sequence = self._remove(expired)[1]
+            print(f"Expired {len(expired)} transactions from the mempool")
+        return len(expired), sequence
+
+    def add(self, tx_dict):
+        """Persist and index a transaction, False if it is already pending or pays too little to fit"""
+        with self.lock:
+            if tx_dict['tx_hash'] in self.transactions:
+                return False
+            self._expire()
+
+            size = transaction_size(tx_dict)
+            if size > self.max_bytes:
+                return False
+            if self._is_full(1, size):
+                # Only make room for a transaction that pays more per byte than the ones it pushes out
+                if self._evict(1, size, below_rate=fee_rate(tx_dict, size)) is None:
+                    print("Mempool is full and the transaction's fee rate is too low")
+                    return False
+
+            # Written now, made durable below; the records of any removals above come before it
+            sequence = self.pool.add(tx_dict, wait=False)
+            self._insert(tx_dict, size, time.time())
+            if self.on_add is not None:
+                self.on_add(tx_dict)
+
+        # Outside the lock, so admissions arriving together share one fsync of the pool's log
+        self.pool.wait(sequence)
+        return True
+
+    def get(self, tx_hash):
+        return self.transactions.get(tx_hash)
+
+    def from_sender(self, sender):
+        with self.lock:
+            return [self.transactions[tx_hash] for tx_hash in self.by_sender.get(sender, ())]
+
+    def select(self, max_count, max_bytes):
+        """Greedily pick the highest fee-rate transactions that fit in max_count entries and max_bytes"""
+        with self.lock:
+            self._expire()
+            ranked = sorted(self.entries.items(), key=lambda item: (-item[1][0], item[1][2]))
+            selected = []
+            size = 0
+            for tx_hash, (rate, tx_size, arrival) in ranked:
+                if len(selected) == max_count:
+                    break
+                if size + tx_size > max_bytes:
+                    continue  # A smaller one further down may still fit
+                selected.append(self.transactions[tx_hash])
+                size += tx_size
+            return selected
+
+    def remove(self, tx_hashes):
+        """Drop the given transactions, returns the ones that were pending"""
+        with self.lock:
+            removed, sequence = self._remove(tx_hashes)
+        self.pool.wait(sequence)
+        return removed
+
+    def _remove(self, tx_hashes):
+        """remove() for callers holding the lock, returns (removed, pool sequence number to wait for)"""
+        removed = [tx_dict for tx_dict in map(self._discard, tx_hashes) if tx_dict is not None]
+        sequence = None
+        if removed:
+            sequence = self.pool.remove([tx_dict['tx_hash'] for tx_dict in removed], wait=False)
+            if self.on_remove is not None:
+                self.on_remove(removed)
+        # Drop the heap entries of removed transactions once they make up most of it
+        if len(self._by_fee_rate) > 2 * len(self.transactions) + 64:
+            self._by_fee_rate = [item for item in self._by_fee_rate if item[2] in self.transactions]
+            heapq.heapify(self._by_fee_rate)
+        return removed, sequence
+
+    def remove_confirmed(self, block):
+        """Drop exactly the transactions a newly connected block contains"""
+        return self.remove(tx['tx_hash'] for tx in block['transactions'])
+
+    def clear(self):
+        with self.lock:
+            self.transactions = {}
+            self.by_sender = {}
+            self.entries = {}
+            self.total_bytes = 0
+            self._by_fee_rate = []
+            self.pool.clear()
+
+    def load(self):
+        with self.lock:
+            return list(self.transactions.values())
+
+    def latest_hash(self):
+        with self.lock:
+            if not self.transactions:
+                return None
+            return next(reversed(self.transactions))
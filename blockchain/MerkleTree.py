@@ -0,0 +1,96 @@
+import hashlib
+from binascii import hexlify
+
+
+class MerkleTree:
+    """Merkle tree over transaction hashes that keeps its levels so it can grow and prove inclusion"""
+
+    def __init__(self, tx_hashes=(), legacy=False):
+        # Legacy trees hash the hex strings of their children, like blocks mined before version 3
+        self.legacy = legacy
+        self.levels = [[]]  # levels[0] holds the leaves, levels[-1] the root
+        self.positions = {}  # tx_hash -> leaf index
+        for tx_hash in tx_hashes:
+            self.append(tx_hash)
+
+    def __len__(self):
+        return len(self.levels[0])
+
+    @property
+    def root(self):
+        if not self.levels[0]:
+            return None
+        return self.levels[-1][0].hex()
+
+    @staticmethod
+    def hash_leaf(tx_hash, legacy=False):
+        if not isinstance(tx_hash, str):
+            return hashlib.sha256(tx_hash.to_bytes(8, 'big')).digest()
+        if legacy:
+            return hashlib.sha256(tx_hash.encode()).digest()
+        return hashlib.sha256(bytes.fromhex(tx_hash)).digest()
+
+    @staticmethod
+    def hash_pair(left, right, legacy=False):
+        if legacy:
+            return hashlib.sha256(hexlify(left) + hexlify(right)).digest()
+        return hashlib.sha256(left + right).digest()
+
+    def append(self, tx_hash):
+        """Add one transaction and recompute only the path from its leaf to the root"""
+        leaves = self.levels[0]
+        self.positions.setdefault(tx_hash, len(leaves))
+        leaves.append(self.hash_leaf(tx_hash, self.legacy))
+
+        position = len(leaves) - 1
+        depth = 0
+        while len(self.levels[depth]) > 1:
+            level = self.levels[depth]
+            if depth + 1 == len(self.levels):
+                self.levels.append([])
+            parent_level = self.levels[depth + 1]
+
+            parent = position // 2
+            left = level[2 * parent]
+            # Duplicate the last node when a level has an odd number of nodes
+            right = level[2 * parent + 1] if 2 * parent + 1 < len(level) else left
+            combined = self.hash_pair(left, right, self.legacy)
+
+            if parent < len(parent_level):
+                parent_level[parent] = combined
+            else:
+                parent_level.append(combined)
+
+            position = parent
+            depth += 1
+
+    def extend(self, tx_hashes):
+        for tx_hash in tx_hashes:
+            self.append(tx_hash)
+
+    def get_proof(self, tx_hash):
+        """Sibling hashes from the leaf up to the root, each with the side it sits on"""
+        if tx_hash not in self.positions:
+            return None
+
+        position = self.positions[tx_hash]
+        proof = []
+        for level in self.levels[:-1]:
+            if position % 2 == 0:
+                sibling = level[position + 1] if position + 1 < len(level) else level[position]
+                proof.append([sibling.hex(), 'right'])
+            else:
+                proof.append([level[position - 1].hex(), 'left'])
+            position //= 2
+        return proof
+
+    @classmethod
+    def verify_proof(cls, tx_hash, proof, merkle_root, legacy=False):
+        current = cls.hash_leaf(tx_hash, legacy)
+        for sibling_hex, side in proof:
+            sibling = bytes.fromhex(sibling_hex)
+            if side == 'left':
+                current = cls.hash_pair(sibling, current, legacy)
+            else:
+                current = cls.hash_pair(current, sibling, legacy)
+        return current.hex() == merkle_root
@@ -0,0 +1,127 @@
+import threading
+import time
+
+
+class Miner:
+    """Background mining service that restarts on a fresh template whenever the chain tip moves"""
+
+    def __init__(self, blockchain, node=None, address=None, min_pending=5, idle_wait=5.0):
+        self.blockchain = blockchain
+        self.node = node
+        self.address = address
+        self.min_pending = min_pending  # Pending transactions needed before a block is worth mining
+        self.idle_wait = idle_wait  # Seconds between checks of the pending pool while idle
+
+        self.state = 'stopped'  # stopped, idle or mining
+        self.blocks_mined = 0
+        self.templates_cancelled = 0
+        self.last_block_hash = None
+        self.current_block = None
+        self.mining_started_at = None
+
+        self._thread = None
+        self._running = threading.Event()
+        self._cancel = threading.Event()
+        self._wake = threading.Event()
+
+    def start(self, address=None):
+        if address is not None:
+            self.address = address
+        if self._thread is not None and self._thread.is_alive():
+            return False
+
+        self._running.set()
+        self._cancel.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="Miner")
+        self._thread.start()
+        print(f"Miner started, rewards go to {self.address}")
+        return True
+
+    def stop(self):
+        """Stop mining and shut the service down"""
+        self._running.clear()
+        self._cancel.set()
+        self._wake.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+        self.state = 'stopped'
+        print("Miner stopped")
+
+    def cancel(self):
+        """Abandon the block being mined, the service picks up a fresh template"""
+        self._cancel.set()
+        self._wake.set()
+
+    def notify(self):
+        """Wake the miner up to check the pending pool, e.g. after a new transaction"""
+        self._wake.set()
+
+    def on_new_tip(self, tip_hash):
+        """Called when another block extends the chain, the current template is now stale"""
+        current_block = self.current_block
+        if current_block is not None and current_block.prev_hash == tip_hash:
+            return
+
+        if current_block is not None:
+            print("Chain tip changed, restarting miner on a fresh template")
+            self.templates_cancelled += 1
+        # Also cancels a template that is being built right now on the old tip
+        self.cancel()
+
+    def get_hashrate(self):
+        current_block = self.current_block
+        if self.state != 'mining' or current_block is None or not self.mining_started_at:
+            return 0
+        elapsed = time.time() - self.mining_started_at
+        if elapsed <= 0:
+            return 0
+        return current_block.hashes_tried / elapsed
+
+    def get_status(self):
+        current_block = self.current_block
+        return {
+            'state': self.state,
+            'address': self.address,
+            'hashrate': round(self.get_hashrate(), 2),
+            'workers': self.blockchain.mining_workers,
+            'mining_height': current_block.index if current_block is not None and self.state == 'mining' else None,
+            'blocks_mined': self.blocks_mined,
+            'templates_cancelled': self.templates_cancelled,
+            'last_block_hash': self.last_block_hash,
+        }
+
+    def _run(self):
+        while self._running.is_set():
+            try:
+                if len(self.blockchain.mempool) < self.min_pending:
+                    self.state = 'idle'
+                    self._wake.wait(timeout=self.idle_wait)
+                    self._wake.clear()
+                    continue
+
+                # Anything cancelled before this point applied to the previous template
+                self._cancel.clear()
+                self._wake.clear()
+                self.current_block = self.blockchain.create_block_template(self.address)
+                self.mining_started_at = time.time()
+                self.state = 'mining'
+
+                new_block = self.blockchain.mine_block(address=self.address, cancel_event=self._cancel,
+                                                       block_object=self.current_block)
+                self.current_block = None
+
+                if new_block:
+                    self.blocks_mined += 1
+                    self.last_block_hash = new_block['hash']
+                    print(f"Miner found block {new_block['index']} ({new_block['hash']})")
+                    if self.node is not None:
+                        self.node.broadcast_new_block(new_block)
+
+            except Exception as e:
+                print(f"Miner error: {e}")
+                self.current_block = None
+                self._wake.wait(timeout=self.idle_wait)
+                self._wake.clear()
+
+        self.state = 'stopped'
@@ -0,0 +1,232 @@
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+
+# Every change to the pool is one framed record: op (1 byte) | payload length (4) | crc32 of payload (4) | payload
+WAL_RECORD_FORMAT = struct.Struct('>cII')
+OP_ADD = b'A'  # payload is the transaction JSON
+OP_REMOVE = b'R'  # payload is a JSON list of tx hashes
+OP_CLEAR = b'C'  # empty payload
+WAL_OPS = (OP_ADD, OP_REMOVE, OP_CLEAR)
+
+# Admissions arriving within this many seconds of each other share one fsync, 0 syncs every admission on its own
+COMMIT_WINDOW = 0.005
+
+# Rewrite the log with only the live transactions once it holds this many records more than the pool
+COMPACT_SLACK = 1000
+
+
+class PendingPool:
+    """Makes the mempool durable through an append-only write-ahead log, it keeps no transactions of its own
+
+    The log is replayed once at startup (load). Compaction rewrites it from the mempool's live transactions,
+    which the mempool hands over through live_transactions.
+    """
+
+    def __init__(self, path='my_data/pending.wal', legacy_path='my_data/pending_transactions.json',
+                 commit_window=COMMIT_WINDOW, compact_slack=COMPACT_SLACK):
+        self.path = path
+        self.commit_window = commit_window
+        self.compact_slack = compact_slack
+
+        self._recovered = {}  # tx_hash -> transaction dict replayed from the log, until load() hands it over
+        self._live = 0  # Transactions the log leaves pending
+        self._records = 0  # Records in the log, live or not
+        # Returns the pending transaction dicts, set by the mempool; without it the log is never compacted
+        self.live_transactions = None
+
+        # Group commit: writers append under the condition's lock and wait until the committer has synced past them
+        self.condition = threading.Condition()
+        self._written = 0  # Sequence number of the last record written
+        self._synced = 0  # Sequence number of the last record known to be on disk
+        self._committer = None
+
+        self._recover()
+        if not os.path.exists(path) and legacy_path and os.path.exists(legacy_path):
+            self._import_json(legacy_path)
+        self._file = open(path, 'ab')
+
+    def __len__(self):
+        return self._live
+
+    # --- Recovery ---
+
+    def _recover(self):
+        """Replay the log into memory and cut it at the first torn record"""
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, 'rb') as f:
+            data = f.read()
+
+        offset = 0
+        while offset < len(data):
+            if len(data) - offset < WAL_RECORD_FORMAT.size:
+                break
+            op, length, checksum = WAL_RECORD_FORMAT.unpack_from(data, offset)
+            start = offset + WAL_RECORD_FORMAT.size
+            payload = data[start:start + length]
+            if op not in WAL_OPS or len(payload) != length or zlib.crc32(payload) != checksum:
+                break
+
+            if op == OP_ADD:
+                tx_dict = json.loads(payload)
+                self._recovered.setdefault(tx_dict['tx_hash'], tx_dict)
+            elif op == OP_REMOVE:
+                for tx_hash in json.loads(payload):
+                    self._recovered.pop(tx_hash, None)
+            else:
+                self._recovered = {}
+            self._records += 1
+            offset = start + length
+
+        if offset != len(data):
+            print(f"Pending transaction log {self.path} has a torn record at {offset}, truncating it")
+            with open(self.path, 'r+b') as f:
+                f.truncate(offset)
+        self._live = len(self._recovered)
+
+    def _import_json(self, legacy_path):
+        """One-off import of the old pending_transactions.json"""
+        with open(legacy_path, 'r') as f:
+            for tx_dict in json.load(f):
+                self._recovered.setdefault(tx_dict['tx_hash'], tx_dict)
+        self._write_compacted(self._recovered.values())
+        print(f"Imported {self._live} pending transactions from {legacy_path}")
+
+    # --- Log writing ---
+
+    @staticmethod
+    def _encode(op, payload=b''):
+        return WAL_RECORD_FORMAT.pack(op, len(payload), zlib.crc32(payload)) + payload
+
+    def _append_record(self, op, payload=b''):
+        """Write one record, must hold the condition; returns its sequence number"""
+        self._file.write(self._encode(op, payload))
+        self._records += 1
+        self._written += 1
+        return self._written
+
+    def _wait_durable(self, sequence):
+        """Block until the record with this sequence number has been fsynced, must hold the condition"""
+        if self.commit_window <= 0:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._synced = self._written
+            return
+
+        if self._committer is None or not self._committer.is_alive():
+            self._committer = threading.Thread(target=self._commit_loop, daemon=True)
+            self._committer.start()
+        self.condition.notify_all()
+        while self._synced < sequence:
+            self.condition.wait()
+
+    def _commit_loop(self):
+        """One fsync for every batch of records written within the commit window"""
+        while True:
+            with self.condition:
+                while self._synced == self._written:
+                    self.condition.wait()
+
+            # Let more writers join this batch before paying for the fsync
+            time.sleep(self.commit_window)
+
+            with self.condition:
+                self._file.flush()
+                batch_end = self._written
+                fileno = self._file.fileno()
+            try:
+                os.fsync(fileno)
+            except OSError:
+                pass  # A compaction swapped the file, it synced everything itself
+
+            with self.condition:
+                self._synced = max(self._synced, batch_end)
+                self.condition.notify_all()
+
+    def _write_compacted(self, transactions):
+        """Atomically replace the log with one add record per live transaction"""
+        temp_path = self.path + '.tmp'
+        records = 0
+        with open(temp_path, 'wb') as f:
+            for tx_dict in transactions:
+                f.write(self._encode(OP_ADD, json.dumps(tx_dict).encode()))
+                records += 1
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        self._records = self._live = records
+
+    def compact(self, transactions):
+        """Rewrite the log from the live transactions, which must be everything the mempool holds"""
+        with self.condition:
+            self._file.flush()
+            self._file.close()
+            self._write_compacted(transactions)
+            self._file = open(self.path, 'ab')
+            # Everything written so far is in the new file, which is already on disk
+            self._synced = self._written
+            self.condition.notify_all()
+
+    def _compact_if_due(self):
+        if self.live_transactions is not None and self._records - self._live >= self.compact_slack:
+            self.compact(self.live_transactions())
+
+    # --- Pool interface ---
+
+    def load(self):
+        """Transactions the log left pending, for the mempool to start from; only the first call has them"""
+        with self.condition:
+            transactions = list(self._recovered.values())
+            self._recovered = {}
+            return transactions
+
+    def add(self, tx_dict, wait=True):
+        """Log a transaction the mempool admitted, returns the record's sequence number
+
+        With wait=False the record is written but not yet durable, pass the sequence number to wait() for that.
+        """
+        with self.condition:
+            sequence = self._append_record(OP_ADD, json.dumps(tx_dict).encode())
+            self._live += 1
+            if wait:
+                self._wait_durable(sequence)
+        return sequence
+
+    def remove(self, tx_hashes, wait=True):
+        """Log the removal of pending transactions with a single record, e.g. the ones a new block confirmed"""
+        tx_hashes = list(tx_hashes)
+        if not tx_hashes:
+            return None
+        with self.condition:
+            sequence = self._append_record(OP_REMOVE, json.dumps(tx_hashes).encode())
+            self._live -= len(tx_hashes)
+            if wait:
+                self._wait_durable(sequence)
+            self._compact_if_due()
+        return sequence
+
+    def wait(self, sequence):
+        """Block until the record add() or remove() returned, and every one before it, is on disk"""
+        if sequence is None:
+            return
+        with self.condition:
+            self._wait_durable(sequence)
+
+    def clear(self):
+        with self.condition:
+            sequence = self._append_record(OP_CLEAR)
+            self._live = 0
+            self._wait_durable(sequence)
+            self._compact_if_due()
+
+    def close(self):
+        with self.condition:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._synced = self._written
+            self._file.close()
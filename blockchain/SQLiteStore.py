@@ -0,0 +1,293 @@
+import json
+import os
+import sqlite3
+import threading
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS blocks (
+    height INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL UNIQUE,
+    header TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    height INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    tx_hash TEXT NOT NULL,
+    sender TEXT,
+    recipient TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (height, position)
+);
+CREATE INDEX IF NOT EXISTS transactions_tx_hash ON transactions (tx_hash);
+CREATE INDEX IF NOT EXISTS transactions_sender ON transactions (sender, height, position);
+CREATE INDEX IF NOT EXISTS transactions_recipient ON transactions (recipient, height, position);
+CREATE TABLE IF NOT EXISTS transaction_recipients (
+    recipient TEXT NOT NULL,
+    height INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (recipient, height, position)
+);
+CREATE TABLE IF NOT EXISTS pending_transactions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tx_hash TEXT NOT NULL,
+    sender TEXT,
+    recipient TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pending_tx_hash ON pending_transactions (tx_hash);
+'''
+
+
+class SQLiteStore:
+    """Optional SQLite backend for blocks and pending transactions, indexed by hash, height, tx_hash and address"""
+
+    def __init__(self, path='my_data/chain.db', legacy_path='my_data/blockchain.json',
+                 legacy_pending_path='my_data/pending_transactions.json'):
+        self.path = path
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+        self.pending_pool = SQLitePendingPool(self)
+        # Pruning is only supported by the block log
+        self.pruning = False
+        self.pruned_height = 0
+
+        self.hashes = [row[0] for row in self.connection.execute('SELECT hash FROM blocks ORDER BY height')]
+        if not self.hashes and legacy_path and os.path.exists(legacy_path):
+            self.import_json(legacy_path, legacy_pending_path)
+
+    def __len__(self):
+        return len(self.hashes)
+
+    @staticmethod
+    def _transaction_rows(block, height):
+        rows = []
+        for position, transaction in enumerate(block['transactions']):
+            rows.append((height, position, transaction['tx_hash'], transaction.get('sender'),
+                         transaction.get('recipient'), json.dumps(transaction)))
+        return rows
+
+    @staticmethod
+    def _recipient_rows(block, height):
+        """Recipients of multi-output transactions, which have no single recipient column to go in"""
+        rows = set()
+        for position, transaction in enumerate(block['transactions']):
+            for output in transaction.get('outputs', ()):
+                rows.add((output['recipient'], height, position))
+        return rows
+
+    def _insert_block(self, block, height):
+        header = {key: value for key, value in block.items() if key != 'transactions'}
+        self.connection.execute('INSERT INTO blocks (height, hash, header) VALUES (?, ?, ?)',
+                                (height, block['hash'], json.dumps(header)))
+        self.connection.executemany(
+            'INSERT INTO transactions (height, position, tx_hash, sender, recipient, data) VALUES (?, ?, ?, ?, ?, ?)',
+            self._transaction_rows(block, height))
+        self.connection.executemany(
+            'INSERT INTO transaction_recipients (recipient, height, position) VALUES (?, ?, ?)',
+            self._recipient_rows(block, height))
+
+    def append(self, block, sync=True):
+        """Write a block and all its transactions in one database transaction, returns its height"""
+        with self.lock:
+            height = len(self.hashes)
+            with self.connection:
+                self._insert_block(block, height)
+            self.hashes.append(block['hash'])
+            return height
+
+    def append_many(self, blocks):
+        with self.lock:
+            with self.connection:
+                for block in blocks:
+                    self._insert_block(block, len(self.hashes))
+                    self.hashes.append(block['hash'])
+
+    def import_json(self, legacy_path, legacy_pending_path=None):
+        """One-shot migration from blockchain.json and pending_transactions.json"""
+        with open(legacy_path, 'r') as f:
+            blocks = json.load(f)
+
+        pending = []
+        if legacy_pending_path and os.path.exists(legacy_pending_path):
+            with open(legacy_pending_path, 'r') as f:
+                pending = json.load(f)
+
+        with self.lock:
+            with self.connection:
+                for block in blocks:
+                    self._insert_block(block, len(self.hashes))
+                    self.hashes.append(block['hash'])
+                self.pending_pool.insert_many(pending)
+        print(f"Imported {len(blocks)} blocks and {len(pending)} pending transactions into {self.path}")
+
+    def reset(self, blocks):
+        with self.lock:
+            with self.connection:
+                self.connection.execute('DELETE FROM transactions')
+                self.connection.execute('DELETE FROM transaction_recipients')
+                self.connection.execute('DELETE FROM blocks')
+                self.hashes = []
+                for block in blocks:
+                    self._insert_block(block, len(self.hashes))
+                    self.hashes.append(block['hash'])
+
+    def sync(self):
+        with self.lock:
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def _build_block(self, height, header):
+        block = json.loads(header)
+        rows = self.connection.execute('SELECT data FROM transactions WHERE height = ? ORDER BY position', (height,))
+        block['transactions'] = [json.loads(row[0]) for row in rows]
+        return block
+
+    def get_block(self, height):
+        if height < 0:
+            height += len(self.hashes)
+        if height < 0 or height >= len(self.hashes):
+            return None
+
+        with self.lock:
+            row = self.connection.execute('SELECT header FROM blocks WHERE height = ?', (height,)).fetchone()
+            return self._build_block(height, row[0])
+
+    def get_header(self, height):
+        """Block header without its transactions"""
+        if height < 0:
+            height += len(self.hashes)
+        if height < 0 or height >= len(self.hashes):
+            return None
+
+        with self.lock:
+            row = self.connection.execute('SELECT header FROM blocks WHERE height = ?', (height,)).fetchone()
+        return json.loads(row[0])
+
+    def get_tx_count(self, height):
+        if height < 0:
+            height += len(self.hashes)
+        if height < 0 or height >= len(self.hashes):
+            return None
+
+        with self.lock:
+            row = self.connection.execute('SELECT COUNT(*) FROM transactions WHERE height = ?', (height,)).fetchone()
+        return row[0]
+
+    def has_body(self, height):
+        return -len(self.hashes) <= height < len(self.hashes)
+
+    def prune(self, max_height):
+        return 0
+
+    def get_block_by_hash(self, block_hash):
+        with self.lock:
+            row = self.connection.execute('SELECT height, header FROM blocks WHERE hash = ?', (block_hash,)).fetchone()
+            if row is None:
+                return None
+            return self._build_block(row[0], row[1])
+
+    def get_height(self, block_hash):
+        with self.lock:
+            row = self.connection.execute('SELECT height FROM blocks WHERE hash = ?', (block_hash,)).fetchone()
+        return row[0] if row else None
+
+    def get_block_hash(self, height):
+        if height < 0:
+            height += len(self.hashes)
+        if height < 0 or height >= len(self.hashes):
+            return None
+        return self.hashes[height]
+
+    def get_latest_block(self):
+        return self.get_block(-1)
+
+    def iter_blocks(self, start=0, end=None):
+        end = len(self.hashes) if end is None else min(end, len(self.hashes))
+        for height in range(max(start, 0), end):
+            yield self.get_block(height)
+
+    def iter_headers(self, start=0, end=None):
+        end = len(self.hashes) if end is None else min(end, len(self.hashes))
+        for height in range(max(start, 0), end):
+            yield self.get_header(height)
+
+    def get_blocks(self, start=0, end=None):
+        return list(self.iter_blocks(start, end))
+
+    def find_transaction(self, tx_hash):
+        """(height, position) of the first confirmed transaction with this hash"""
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT height, position FROM transactions WHERE tx_hash = ? ORDER BY height, position LIMIT 1',
+                (tx_hash,)).fetchone()
+        return tuple(row) if row else None
+
+    def count_address_transactions(self, address):
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT COUNT(*) FROM (SELECT height, position FROM transactions WHERE sender = ? '
+                'UNION SELECT height, position FROM transactions WHERE recipient = ? '
+                'UNION SELECT height, position FROM transaction_recipients WHERE recipient = ?)',
+                (address, address, address)).fetchone()
+        return row[0]
+
+    def get_address_transactions(self, address, page=1, page_size=10):
+        """One page of (height, position, transaction) for an address, newest first"""
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT height, position, data FROM transactions WHERE sender = ? '
+                'UNION SELECT height, position, data FROM transactions WHERE recipient = ? '
+                'UNION SELECT t.height, t.position, t.data FROM transaction_recipients r '
+                'JOIN transactions t ON t.height = r.height AND t.position = r.position WHERE r.recipient = ? '
+                'ORDER BY height DESC, position DESC LIMIT ? OFFSET ?',
+                (address, address, address, page_size, (page - 1) * page_size)).fetchall()
+        return [(height, position, json.loads(data)) for height, position, data in rows]
+
+
+class SQLitePendingPool:
+    """Pending transactions kept in the pending_transactions table of a SQLiteStore"""
+
+    def __init__(self, store):
+        self.store = store
+
+    def __len__(self):
+        with self.store.lock:
+            return self.store.connection.execute('SELECT COUNT(*) FROM pending_transactions').fetchone()[0]
+
+    def load(self):
+        with self.store.lock:
+            rows = self.store.connection.execute('SELECT data FROM pending_transactions ORDER BY id')
+            return [json.loads(row[0]) for row in rows]
+
+    def insert_many(self, tx_dicts):
+        self.store.connection.executemany(
+            'INSERT INTO pending_transactions (tx_hash, sender, recipient, data) VALUES (?, ?, ?, ?)',
+            [(tx['tx_hash'], tx.get('sender'), tx.get('recipient'), json.dumps(tx)) for tx in tx_dicts])
+
+    def add(self, tx_dict, wait=True):
+        """Store a transaction the mempool admitted, committed before this returns so there is nothing to wait for"""
+        with self.store.lock:
+            with self.store.connection:
+                self.insert_many([tx_dict])
+        return None
+
+    def remove(self, tx_hashes, wait=True):
+        with self.store.lock:
+            with self.store.connection:
+                self.store.connection.executemany('DELETE FROM pending_transactions WHERE tx_hash = ?',
+                                                  [(tx_hash,) for tx_hash in tx_hashes])
+        return None
+
+    def wait(self, sequence):
+        pass
+
+    def clear(self):
+        with self.store.lock:
+            with self.store.connection:
+                self.store.connection.execute('DELETE FROM pending_transactions')
@@ -0,0 +1,87 @@
+import hashlib
+import json
+import os
+import struct
+
+# magic (4 bytes) | height (8) | sha256 of the payload (32), then the JSON payload
+SNAPSHOT_MAGIC = b'BCSS'
+SNAPSHOT_HEADER_FORMAT = struct.Struct('>4sQ32s')
+
+# Write a snapshot every this many blocks and keep the newest few in case one is damaged
+SNAPSHOT_INTERVAL = 100
+SNAPSHOT_KEEP = 3
+
+
+class SnapshotStore:
+    """Checksummed snapshots of derived state, each tagged with the height and hash of the block it reflects"""
+
+    def __init__(self, path='my_data/snapshots', keep=SNAPSHOT_KEEP):
+        self.path = path
+        self.keep = keep
+        os.makedirs(path, exist_ok=True)
+
+    def snapshot_path(self, height):
+        return os.path.join(self.path, f'state{height:010d}.snap')
+
+    def heights(self):
+        """Heights of the snapshots on disk, newest first"""
+        heights = []
+        for name in os.listdir(self.path):
+            if name.startswith('state') and name.endswith('.snap'):
+                try:
+                    heights.append(int(name[5:-5]))
+                except ValueError:
+                    continue
+        return sorted(heights, reverse=True)
+
+    def write(self, height, tip_hash, state):
+        payload = json.dumps({'height': height, 'tip_hash': tip_hash, 'state': state}).encode()
+        header = SNAPSHOT_HEADER_FORMAT.pack(SNAPSHOT_MAGIC, height, hashlib.sha256(payload).digest())
+
+        # Write to a temporary file first so a crash never leaves a half-written snapshot
+        path = self.snapshot_path(height)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(header + payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+
+        for old_height in self.heights()[self.keep:]:
+            os.remove(self.snapshot_path(old_height))
+
+    def read(self, height):
+        """The snapshot taken at height, or None if it is missing or fails its checksum"""
+        try:
+            with open(self.snapshot_path(height), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+
+        if len(data) < SNAPSHOT_HEADER_FORMAT.size:
+            return None
+        magic, stored_height, checksum = SNAPSHOT_HEADER_FORMAT.unpack_from(data)
+        payload = data[SNAPSHOT_HEADER_FORMAT.size:]
+        if magic != SNAPSHOT_MAGIC or stored_height != height or hashlib.sha256(payload).digest() != checksum:
+            return None
+
+        snapshot = json.loads(payload)
+        return snapshot if snapshot['height'] == height else None
+
+    def load_latest(self, store):
+        """Newest snapshot that is intact and whose block is still in the chain at the same height"""
+        for height in self.heights():
+            if height == 0 or height > len(store):
+                continue
+            snapshot = self.read(height)
+            if snapshot is None:
+                print(f"State snapshot at height {height} is damaged, skipping it")
+                continue
+            if store.get_block_hash(height - 1) != snapshot['tip_hash']:
+                continue
+            return snapshot
+        return None
+
+    def clear(self):
+        for height in self.heights():
+            os.remove(self.snapshot_path(height))
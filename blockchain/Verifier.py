@@ -0,0 +1,132 @@
+import threading
+
+from Transactions import Transactions, has_valid_fee, key_cache, transaction_fee, verify_cache
+
+from .Workers import process_context
+
+# Transactions sent to a worker at a time
+VERIFY_CHUNK_SIZE = 16
+
+# Coins a block may create on top of the fees its transactions pay
+BLOCK_REWARD = 10
+
+
+def verify_transaction(tx_dict):
+    """Structure and signature check of one transaction dict, coinbase transactions have no signature to check"""
+    if not has_valid_fee(tx_dict):
+        return False
+    if not tx_dict.get('sender'):
+        amount = tx_dict.get('amount')
+        return tx_dict.get('recipient') is not None and type(amount) in (int, float) and amount > 0
+    try:
+        return Transactions.from_dict(tx_dict).is_valid()
+    except (KeyError, TypeError, ValueError):
+        return False
+
+
+def is_coinbase(tx_dict):
+    return not tx_dict.get('sender')
+
+
+def verify_coinbase(block):
+    """Exactly one coinbase, last in the block, creating at most the reward plus the block's fees"""
+    transactions = block['transactions']
+    if not transactions or not is_coinbase(transactions[-1]):
+        print("The block does not end with its coinbase transaction")
+        return False
+    if any(is_coinbase(tx_dict) for tx_dict in transactions[:-1]):
+        print("The block has more than one coinbase transaction")
+        return False
+    if not all(has_valid_fee(tx_dict) for tx_dict in transactions):
+        print("The block has a transaction whose fee is not a non-negative number")
+        return False
+    fees = sum(transaction_fee(tx_dict) for tx_dict in transactions[:-1])
+    if not verify_transaction(transactions[-1]) or transactions[-1]['amount'] > BLOCK_REWARD + fees:
+        print("The block's coinbase claims more than the reward plus fees")
+        return False
+    return True
+
+
+def verify_chunk(tx_dicts):
+    return [verify_transaction(tx_dict) for tx_dict in tx_dicts]
+
+
+def _verify_chunk_in_worker(tx_dicts):
+    """Results plus the key cache timings they took, for the parent to report"""
+    return verify_chunk(tx_dicts), key_cache.take_timings()
+
+
+def cached_result(tx_dict):
+    """(result, cache key) from this process's cache; result is None if the signature still has to be verified"""
+    # A null fee reads as no fee once parsed, so it has to be caught before the cache is consulted
+    if not tx_dict.get('sender') or not has_valid_fee(tx_dict):
+        return verify_transaction(tx_dict), None
+    try:
+        transaction = Transactions.from_dict(tx_dict)
+    except (KeyError, TypeError, ValueError):
+        return False, None
+    if not transaction.has_valid_structure():
+        return False, None
+    key = transaction.verify_cache_key()
+    return verify_cache.get(key), key
+
+
+class Verifier:
+    """Spreads signature verification of many transactions across a process pool"""
+
+    def __init__(self, workers=1):
+        self.workers = workers
+        self.lock = threading.Lock()
+        self._pool = None  # Started on the first batch big enough to need it
+
+    def _get_pool(self):
+        with self.lock:
+            if self._pool is None:
+                context = process_context()
+                self._pool = context.Pool(self.workers)
+            return self._pool
+
+    def verify_transactions(self, tx_dicts):
+        """One result per transaction dict, True if its signature and structure are valid"""
+        tx_dicts = list(tx_dicts)
+        if self.workers <= 1 or not tx_dicts:
+            return verify_chunk(tx_dicts)
+
+        # The workers have caches of their own, but only this process's cache sees every transaction
+        results = []
+        misses = []  # (position, cache key)
+        for position, tx_dict in enumerate(tx_dicts):
+            result, key = cached_result(tx_dict)
+            results.append(result)
+            if result is None:
+                misses.append((position, key))
+        if not misses:
+            return results
+
+        # Even a single verify goes to the pool, so handler threads verifying at once do not queue on the GIL
+        # Split into at least one chunk per worker so every core gets a share
+        pending = [tx_dicts[position] for position, _ in misses]
+        chunk_size = min(VERIFY_CHUNK_SIZE, -(-len(pending) // self.workers))
+        chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+        verified = []
+        for chunk_results, timings in self._get_pool().map(_verify_chunk_in_worker, chunks):
+            verified.extend(chunk_results)
+            key_cache.merge_timings(timings)
+        for (position, key), result in zip(misses, verified):
+            verify_cache.put(key, result)
+            results[position] = result
+        return results
+
+    def verify_transaction(self, tx_dict):
+        return self.verify_transactions([tx_dict])[0]
+
+    def verify_block(self, block):
+        """True if the block's coinbase is valid and every transaction in it verifies"""
+        return verify_coinbase(block) and all(self.verify_transactions(block['transactions']))
+
+    def close(self):
+        with self.lock:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
@@ -2,11 +2,32 @@ import hashlib
 import base58
 import os
 import json
-import ecdsa
 
-from ecdsa import SigningKey, SECP256k1
+from Transactions import DEFAULT_FEE, MultiOutputTransaction, Transactions
+from .Crypto import backend
+from .Workers import process_context
 
-from Transactions import Transactions
+
+def address_from_public_key(public_key_bytes):
+    """Base58Check address of a 64-byte public key, as Bitcoin builds P2PKH addresses"""
+    # Step 1: Hash the public key with SHA-256
+    sha256_hash = hashlib.sha256(public_key_bytes).digest()
+
+    # Step 2: Make it shorter
+    ripemd160 = hashlib.new('ripemd160', sha256_hash)
+    public_key_hash = ripemd160.digest()
+
+    # Step 3: Add version byte
+    version_byte = b'\x00'  # Bitcoin mainnet
+    versioned_payload = version_byte + public_key_hash
+
+    # Step 4: Calculate checksum
+    checksum = hashlib.sha256(hashlib.sha256(versioned_payload).digest()).digest()[:4]
+
+    # Step 5: Combine and encode in Base58
+    binary_address = versioned_payload + checksum
+    address_bytes = base58.b58encode(binary_address)  # Returns bytes
+    return address_bytes.decode('utf-8')  # Convert to string
 
 
 class Wallet:
@@ -17,6 +38,7 @@ class Wallet:
         self.public_key = None
         self.address = None
         self.balance = None
+        self._session = None  # WalletSession for the keys loaded now, built when they are loaded or created
         self.wallet_available()
 
 
@@ -46,39 +68,21 @@ class Wallet:
 
     def generate_keys(self):
         #Generate private_key
-        self.private_key = SigningKey.generate(curve=SECP256k1)
-        self.private_key_hex = self.private_key.to_string().hex()
+        private_key_bytes = backend.generate_private_key()
+        self.private_key = backend.load_private_key(private_key_bytes)
+        self.private_key_hex = private_key_bytes.hex()
 
         #Generate public key
-        self.public_key = self.private_key.verifying_key
-        self.public_key_hex = self.public_key.to_string().hex()
+        public_key_bytes = backend.public_key_bytes(self.private_key)
+        self.public_key = backend.load_public_key(public_key_bytes)
+        self.public_key_hex = public_key_bytes.hex()
 
         #Address
         self.address = self.generate_address()
 
     def generate_address(self):
         """Generate wallet address from public key - CORRECTED"""
-        # Step 1: Hash the public key with SHA-256
-        public_key_bytes = bytes.fromhex(self.public_key_hex)
-        sha256_hash = hashlib.sha256(public_key_bytes).digest()
-
-        # Step 2: Make it shorter
-        ripemd160 = hashlib.new('ripemd160', sha256_hash)
-        public_key_hash = ripemd160.digest()
-
-        # Step 3: Add version byte
-        version_byte = b'\x00'  # Bitcoin mainnet
-        versioned_payload = version_byte + public_key_hash
-
-        # Step 4: Calculate checksum
-        checksum = hashlib.sha256(hashlib.sha256(versioned_payload).digest()).digest()[:4]
-
-        # Step 5: Combine and encode in Base58
-        binary_address = versioned_payload + checksum
-        address_bytes = base58.b58encode(binary_address)  # Returns bytes
-        address = address_bytes.decode('utf-8')  # Convert to string
-
-        return address
+        return address_from_public_key(bytes.fromhex(self.public_key_hex))
 
     def save_wallet(self):
         wallet_data = {
@@ -89,6 +93,7 @@ class Wallet:
 
         with open('my_data/Wallets/wallet.json', 'w') as f:
             json.dump(wallet_data, f)
+        self._session = WalletSession(self.address, self.public_key_hex, self.private_key_hex)
 
     def read_wallet(self):
         with open('my_data/Wallets/wallet.json', 'r') as f:
@@ -96,36 +101,100 @@ class Wallet:
         self.private_key_hex = wallet_data['Private Key']
         self.public_key_hex = wallet_data['Public Key']
         self.address = wallet_data['Address']
+        self._session = WalletSession(self.address, self.public_key_hex, self.private_key_hex)
+
+    def session(self):
+        """The WalletSession every payment is signed through, the wallet file is read only if it is not loaded yet"""
+        if self._session is None:
+            self.read_wallet()
+        return self._session
+
+    def create_transaction(self, recipient_address, amount, fee=DEFAULT_FEE):
+        return self.session().create_transaction(recipient_address, amount, fee)
+
+    def create_transactions(self, payments, workers=1):
+        return self.session().create_transactions(payments, workers)
+
+    def create_payout(self, outputs, fee=DEFAULT_FEE):
+        return self.session().create_payout(outputs, fee)
+
+    def sign_transaction(self, transaction):
+        session = self.session()
+        session._apply_signature(transaction, session.sign(transaction.signable_data()))
 
-    def create_transaction(self, recipient_address, amount):
 
-        self.read_wallet()
+# Signing key of a create_transactions worker process, parsed once when the worker starts
+_worker_signing_key = None
 
-        transaction = Transactions(
+
+def _init_signing_worker(private_key_hex):
+    global _worker_signing_key
+    _worker_signing_key = backend.load_private_key(bytes.fromhex(private_key_hex))
+
+
+def _sign_in_worker(signable_data):
+    return backend.sign(_worker_signing_key, signable_data.encode()).hex()
+
+
+class WalletSession:
+    """A wallet's keys loaded and parsed once, so signing a payment costs only the signature"""
+
+    def __init__(self, address, public_key_hex, private_key_hex):
+        self.address = address
+        self.public_key_hex = public_key_hex
+        self.private_key_hex = private_key_hex
+        self.signing_key = backend.load_private_key(bytes.fromhex(private_key_hex))
+
+    def _unsigned(self, recipient_address, amount, fee=DEFAULT_FEE):
+        return Transactions(
             sender=self.address,
-            recipient= recipient_address,
+            recipient=recipient_address,
             amount=amount,
-            sender_public_key = self.public_key_hex
+            sender_public_key=self.public_key_hex,
+            fee=fee
         )
 
-        self.sign_transaction(transaction)
+    @staticmethod
+    def _apply_signature(transaction, signature):
+        transaction.signature = signature
+        # The hash covers the signature, so equal payments from the same sender still get distinct hashes
+        transaction.tx_hash = transaction.calculate_hash()
 
+    def sign(self, data):
+        return backend.sign(self.signing_key, data.encode()).hex()
+
+    def create_transaction(self, recipient_address, amount, fee=DEFAULT_FEE):
+        transaction = self._unsigned(recipient_address, amount, fee)
+        self._apply_signature(transaction, self.sign(transaction.signable_data()))
         return transaction
 
-    def sign_transaction(self, transaction):
-        signable_data = f"{transaction.sender}{transaction.recipient}{transaction.amount}"
+    def create_transactions(self, payments, workers=1):
+        """Signed transactions for (recipient, amount) or (recipient, amount, fee) payments, in the same order
 
-        #sign with private key
-        signature = self._sign_data(signable_data)
+        With workers > 1 the signing is spread over a process pool. The result can go out in one
+        Node.broadcast_transactions call; create_payout is cheaper still when one transaction can carry them all.
+        """
+        transactions = [self._unsigned(*payment) for payment in payments]
+        signable = [transaction.signable_data() for transaction in transactions]
 
-        transaction.signature = signature
+        if workers > 1 and len(transactions) > 1:
+            context = process_context()
+            with context.Pool(workers, initializer=_init_signing_worker, initargs=(self.private_key_hex,)) as pool:
+                signatures = pool.map(_sign_in_worker, signable, chunksize=max(1, len(signable) // (workers * 4)))
+        else:
+            signatures = [self.sign(data) for data in signable]
 
-    def _sign_data(self, data):
-        """Sign data using the wallet's private key"""
-        # Convert private key from hex to signing key object
-        private_key_bytes = bytes.fromhex(self.private_key_hex)
-        signing_key = ecdsa.SigningKey.from_string(private_key_bytes, curve=ecdsa.SECP256k1)
+        for transaction, signature in zip(transactions, signatures):
+            self._apply_signature(transaction, signature)
+        return transactions
 
-        # Sign the data
-        signature = signing_key.sign(data.encode())
-        return signature.hex()
+    def create_payout(self, outputs, fee=DEFAULT_FEE):
+        """One transaction paying every (recipient, amount) in outputs, with a single signature"""
+        transaction = MultiOutputTransaction(
+            sender=self.address,
+            outputs=outputs,
+            sender_public_key=self.public_key_hex,
+            fee=fee
+        )
+        self._apply_signature(transaction, self.sign(transaction.signable_data()))
+        return transaction
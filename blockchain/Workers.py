@@ -0,0 +1,37 @@
+import multiprocessing
+import threading
+
+
+def process_context():
+    """Start method for every worker pool: forkserver where the platform has it, spawn otherwise
+
+    The node, GUI and miner threads may hold chain_lock or a cache lock at any moment. A plain fork copies
+    such a lock into the worker still held, and nothing there will ever release it.
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+# Pools kept for the life of the process, name -> (workers, pool, shared state)
+_shared_pools = {}
+_shared_pools_lock = threading.Lock()
+
+
+def shared_pool(name, workers, initializer=None, make_state=None):
+    """(pool, state) kept under name and reused on every call, started again only if workers changes
+
+    make_state(context) builds an object the workers share, e.g. a multiprocessing Value; it is passed to the
+    initializer of each worker.
+    """
+    with _shared_pools_lock:
+        entry = _shared_pools.get(name)
+        if entry is None or entry[0] != workers:
+            if entry is not None:
+                entry[1].terminate()
+            context = process_context()
+            state = make_state(context) if make_state is not None else None
+            initargs = (state,) if make_state is not None else ()
+            pool = context.Pool(workers, initializer=initializer, initargs=initargs)
+            entry = _shared_pools[name] = (workers, pool, state)
+        return entry[1], entry[2]
@@ -1,185 +1,388 @@
 from coin_base_transactions import CoinBase
 from Transactions import Transactions
-from .Block import Block
-import json
-import os
+from .Block import (Block, BLOCK_VERSION, RAW_MERKLE_VERSION, TARGET_HEADER_VERSION, verify_block_hash,
+                    verify_merkle_root, verify_proof_of_work)
+from .Difficulty import RETARGET_WINDOW, next_bits, next_timestamp, verify_timestamp
+from .MerkleTree import MerkleTree
+from .BlockStore import BlockStore
+from .Ledger import Ledger
+from .Snapshot import SNAPSHOT_INTERVAL
+from .AddressIndex import AddressIndex
+from .PendingPool import PendingPool
+from .Verifier import BLOCK_REWARD, Verifier, verify_coinbase
+from .Mempool import Mempool
+from .SQLiteStore import SQLiteStore
+import threading
+from collections import deque
+
+# The miner, node handlers and GUI all append blocks, only one may do so at a time
+chain_lock = threading.Lock()
+
+# Bytes of transactions a block template may hold, as sized by the binary codec
+MAX_BLOCK_SIZE = 1024 * 1024
 
 class BlockChain:
 
-    def __init__(self):
+    def __init__(self, mining_workers=1, store=None, storage='log', prune_keep_blocks=None, prune_keep_bytes=None,
+                 verify_workers=1):
         self.founder_address = "1HZN9b2CbZHQS9FULHWmeeLKcGkgf6Pxe6"
-        self.chain = []
-        self.transaction_to_add = []
+        # Every block read and write goes through the store: the append-only block log or SQLite
+        # A pruned block log keeps every header but only the bodies of the newest blocks
+        if store is None and storage == 'sqlite':
+            store = SQLiteStore()
+        elif store is None:
+            store = BlockStore(prune_keep_blocks=prune_keep_blocks, prune_keep_bytes=prune_keep_bytes)
+        self.store = store
+        # SQLite keeps pending transactions in the same database, the block log keeps them in a write-ahead log
+        self.pending_pool = getattr(store, 'pending_pool', None)
+        if self.pending_pool is None:
+            self.pending_pool = PendingPool()
+        # What is pending lives in the mempool alone, the pool above just persists it
+        self.mempool = Mempool(self.pending_pool)
         self.max_transaction_per_block = 5
-        self.pending_transactions = self.load_pending_transactions()
-        self.block_height = self.find_block_height()
+        self.max_block_size = MAX_BLOCK_SIZE
+        # Processes used to search for a nonce, 1 keeps mining deterministic
+        self.mining_workers = mining_workers
+        # Processes used to check transaction signatures, 1 verifies in the calling thread
+        self.verifier = Verifier(verify_workers)
+
+        # Authoritative in-memory tip, updated on every append so lookups never touch the disk
+        self.block_height = 0  # Number of blocks in the chain
+        self.tip_hash = None
+        self.tip_header = None
+        # Headers of the blocks the retarget looks at, oldest first
+        self.recent_headers = deque(maxlen=RETARGET_WINDOW + 1)
+        self.load_tip()
+
+        # Balances by address, loaded from the newest matching state snapshot plus the blocks after it
+        self.snapshot_interval = SNAPSHOT_INTERVAL
+        self.ledger = Ledger()
+        try:
+            self.ledger.sync(self.store)
+        except RuntimeError as e:
+            # Balances can not be recovered locally, start empty so the node's first chain request fetches it all
+            print(f"{e}. Discarding the local chain")
+            self.store.reset([])
+            self.load_tip()
+            self.ledger.snapshots.clear()
+            self.ledger.sync(self.store)
+        self.ledger.set_pending(self.load_pending_transaction_dicts())
+        # Pending balances change only with the mempool, under its lock: admitted transactions count towards them,
+        # evicted, expired and confirmed ones no longer do
+        self.mempool.on_add = self.ledger.add_pending
+        self.mempool.on_remove = self.ledger.remove_pending
+
+        # Where each address appears in the chain, for paginated history, unless the store indexes addresses itself
+        self.address_index = None
+        if not hasattr(self.store, 'get_address_transactions'):
+            self.address_index = AddressIndex()
+            self.address_index.sync(self.store)
+        self.snapshot_if_due()
+        self.prune_store()
+
 
 
     def create_genesis_block(self):
         # Creating first transaction
         transaction = CoinBase(recipient=self.founder_address, amount=10000)
 
-        genesis_block = Block(transactions= [transaction], index=0, prev_hash="0" * 64, version = 1)
+        genesis_block = Block(transactions= [transaction], index=0, prev_hash="0" * 64, version = BLOCK_VERSION,
+                              workers=self.mining_workers)
         block_data = genesis_block.block_header()
-        block_data["transactions"] = transaction.to_dict()
-        self.chain.append(block_data)
-        with open("my_data/blockchain.json", "w") as f:
-            json.dump(self.chain, f)
+        block_data["transactions"] = [transaction.to_dict()]
+        with chain_lock:
+            self.store.append(block_data)
+            self.set_tip(block_data)
+            self.connect_block_indexes(block_data)
 
     def load_pending_transactions(self):
-        try:
-            with open('my_data/pending_transactions.json', 'r') as f:
-                tx_data = json.load(f)
-                return [Transactions.from_dict(tx_dict) for tx_dict in tx_data]
-        except FileNotFoundError:
-            return []  # No pending transactions file yet
+        return [Transactions.from_dict(tx_dict) for tx_dict in self.load_pending_transaction_dicts()]
+
+    def load_pending_transaction_dicts(self):
+        return self.mempool.load()
 
     def add_transactions(self, transaction):
-        if transaction.is_valid():
-            self.transaction_to_add.append(transaction)
-            self.save_pending_transactions()  # Save after each addition!
-            print(f"Transaction added to pending pool ({len(self.transaction_to_add)} total)")
+        if transaction.is_valid() and self.save_pending_transactions(transaction):
+            print(f"Transaction added to pending pool ({len(self.mempool)} total)")
             return True
         return False
 
-    def save_pending_transactions(self):
-        transactions_to_save = self.transaction_to_add[0].to_dict()
+    def save_pending_transactions(self, transaction):
+        """Add one of our own transactions to the mempool, False if its hash is already pending"""
+        transactions_to_save = transaction.to_dict()
+
+        transactions_to_save['index'] = len(self.mempool)
+        return self.mempool.add(transactions_to_save)
 
-        with open('my_data/pending_transactions.json', 'r') as f:
-            all_pending_tx = json.load(f)
-        transactions_to_save['index'] = len(all_pending_tx)
-        all_pending_tx.append(transactions_to_save)
+    def add_validated_transaction(self, tx_dict):
+        """Add a transaction the network already validated to the mempool, False if we had it or it is invalid"""
+        # Usually a cache hit, this node verified it when voting on it
+        if not self.verifier.verify_transaction(tx_dict):
+            print("Validated transaction does not verify, not adding it")
+            return False
+        return self.mempool.add(tx_dict)
+
+    @staticmethod
+    def block_header_of(block):
+        return {key: value for key, value in block.items() if key != 'transactions'}
+
+    def load_tip(self):
+        """Rebuild the cached tip from the store, e.g. at startup or after the chain was replaced"""
+        self.recent_headers.clear()
+        for header in self.store.iter_headers(len(self.store) - self.recent_headers.maxlen):
+            self.recent_headers.append(header)
+
+        self.block_height = len(self.store)
+        self.tip_header = self.recent_headers[-1] if self.recent_headers else None
+        self.tip_hash = self.tip_header['hash'] if self.tip_header else None
+
+    def set_tip(self, block):
+        header = self.block_header_of(block)
+        self.recent_headers.append(header)
+        self.tip_header = header
+        self.tip_hash = header['hash']
+        self.block_height += 1
+        self.verify_tip()
+
+    def verify_tip(self):
+        """The cached tip must agree with the store's index, reload it if they ever drift apart"""
+        if len(self.store) == self.block_height and self.store.get_block_hash(-1) == self.tip_hash:
+            return True
+
+        print("Cached chain tip does not match the block store, reloading it")
+        self.load_tip()
+        return False
 
-        with open('my_data/pending_transactions.json', 'w') as f:
-            json.dump(all_pending_tx, f, indent=2)
+    def replace_chain(self, blocks):
+        """Swap the whole chain for one received from another node, False if any of its blocks is invalid"""
+        # The genesis block alone mints the initial supply
+        if not all(verify_coinbase(block) for block in blocks[1:]):
+            return False
+        transactions = [transaction for block in blocks for transaction in block['transactions']]
+        if not all(self.verifier.verify_transactions(transactions)):
+            print("The received chain contains a transaction with an invalid signature")
+            return False
+
+        with chain_lock:
+            self.store.reset(blocks)
+            self.load_tip()
+            self.ledger.rebuild(self.store)
+            if self.address_index is not None:
+                self.address_index.rebuild(self.store)
+            self.prune_store()
+        return True
+
+    def connect_block_indexes(self, block, changes=None):
+        """Bring the derived state up to date with a block that was just appended"""
+        self.ledger.connect_block(block, changes)
+        self.snapshot_if_due()
+        if self.address_index is not None:
+            self.address_index.connect_block(block, self.block_height - 1)
+
+    def snapshot_if_due(self):
+        """Write a state snapshot once snapshot_interval blocks have been applied since the last one"""
+        if self.ledger.height - self.ledger.snapshot_height >= self.snapshot_interval:
+            self.ledger.save()
+            self.prune_store()
+
+    def prune_store(self):
+        """Let a pruning store drop bodies the oldest kept snapshot and the address index no longer need"""
+        if not self.store.pruning:
+            return
+        snapshot_heights = self.ledger.snapshots.heights()
+        if not snapshot_heights:
+            return
+        limit = min(snapshot_heights)
+        if self.address_index is not None:
+            limit = min(limit, self.address_index.height)
+        self.store.prune(limit)
 
     def prev_hash(self):
-        with open("my_data/blockchain.json", "r") as f:
-            blocks = json.load(f)
-        return blocks[-1]['hash']
+        return self.tip_hash
+
+    def create_block_template(self, address):
+        """Build an unmined block on top of the current tip from the pending pool plus a reward"""
+        # The highest fee-rate transactions that fit in one block
+        selected = self.mempool.select(self.max_transaction_per_block, self.max_block_size)
+        transactions = [Transactions.from_dict(tx_dict) for tx_dict in selected]
+        fees = sum(tx.fee or 0 for tx in transactions)
 
-    def mine_block(self, address):
-        block_transactions = []
-        # Retrieve data from the pending_transactions.json
-        transactions = self.load_pending_transactions()
 
+        # Calculate block index
+        index = self.tip_header['index'] + 1
 
-        # Add the reward_tx to transactions folder
-        reward_tx = CoinBase(recipient=address, amount=10)
+        # Add the reward_tx to transactions folder, the height keeps equal rewards to one address apart by hash
+        reward_tx = CoinBase(recipient=address, amount=BLOCK_REWARD + fees if fees else BLOCK_REWARD,
+                             block_height=index)
         transactions.append(reward_tx)
 
-        # Calculate block index
-        with open("my_data/blockchain.json", "r") as f:
-            blocks = json.load(f)
-        index = (blocks[-1]['index']) + 1
+        # Retarget from the recent blocks so block time tracks TARGET_BLOCK_INTERVAL
+        recent_blocks = list(self.recent_headers)
 
         # Call the block class to create a new_block
-        block_object = Block(transactions=transactions, index=index, prev_hash=self.prev_hash(), version=1)
-        block_data = block_object.block_header()
+        return Block(transactions=transactions, index=index, prev_hash=self.prev_hash(), version=BLOCK_VERSION,
+                     workers=self.mining_workers, bits=next_bits(recent_blocks),
+                     timestamp=next_timestamp(recent_blocks))
+
+    def mine_block(self, address, cancel_event=None, block_object=None):
+        block_transactions = []
+        if block_object is None:
+            block_object = self.create_block_template(address)
+
+        block_data = block_object.block_header(cancel_event)
+        if block_data is None:
+            # Mining was cancelled, e.g. because another node extended the chain first
+            return None
+
         # Turn it back to list format
-        for tx in transactions:
+        for tx in block_object.transactions:
             block_transactions.append(tx.to_dict())
 
         block_data["transactions"] = block_transactions
 
-        self.save_new_block(block = block_data, path ="my_data/blockchain.json", path_pending_tranx='my_data/pending_transactions.json')
+        saved = self.save_new_block(block = block_data)
+        if not saved:
+            return None
 
         # Return back the block to be sent to the rest of the network
         return block_data
 
-    #ALERT: Path parameter was for test purposes, you may remove it during production
-    @staticmethod
-    def save_new_block(block, path, path_pending_tranx):
-        #Save to blockchain
-        with open(path, "r") as f:
-            existing_transactions = json.load(f)
+    def save_new_block(self, block):
+        # Signatures are the slow part, check them before holding up everyone else waiting on the chain
+        if not self.verifier.verify_block(block):
+            print("The broadcasted block contains an invalid transaction")
+            return False
+
+        with chain_lock:
+            return self._save_new_block(block)
+
+    def _save_new_block(self, block):
+        recent_blocks = list(self.recent_headers)
 
         # Check if block contains prev_block_hash
-        latest_block = existing_transactions[-1]
-        latest_block_hash = latest_block['hash']
+        latest_block = self.tip_header
+        latest_block_hash = self.tip_hash
         current_block_prev_hash = block["previous_hash"]
 
-        if current_block_prev_hash == latest_block_hash:
-            existing_transactions.append(block)
+        if not verify_block_hash(block):
+            print("The broadcasted block hash does not match its header")
 
-            with open(path, "w") as f:
-                json.dump(existing_transactions, f)
+        elif not verify_proof_of_work(block):
+            print("The broadcasted block hash does not meet its target")
 
-            # Delete existing pending_transactions
-            with open(path_pending_tranx, 'w') as f:
-                json.dump([], f)
+        elif not verify_merkle_root(block):
+            print("The broadcasted block merkle root does not match its transactions")
 
-        else:
+        elif 'bits' in latest_block and block['version'] < TARGET_HEADER_VERSION:
+            print("The broadcasted block does not record its target")
+
+        elif block['version'] >= TARGET_HEADER_VERSION and not BlockChain.verify_target(block, recent_blocks):
+            print("The broadcasted block has an unexpected target or timestamp")
+
+        elif current_block_prev_hash != latest_block_hash:
             print("The broadcasted block has an Invalid block hash sequence to that of the blockchain")
 
+        else:
+            # Work out the balance changes before the block is stored, so nothing can fail between the store
+            # and the indexes built from it
+            try:
+                changes = Ledger.block_changes(block)
+            except (KeyError, TypeError, ValueError):
+                print("The broadcasted block has a malformed transaction")
+                return False
+
+            self.store.append(block)
+            self.set_tip(block)
+            self.connect_block_indexes(block, changes)
+
+            # Only the transactions this block confirmed leave the mempool
+            self.mempool.remove_confirmed(block)
+            return True
+
+        return False
+
     @staticmethod
-    def get_balance(address):
-        balance = 0
-
-        # Read the blockchain file
-        with open('my_data/blockchain.json', 'r') as f:
-            blockchain = json.load(f)
-
-        # Calculating Balance
-        for block in blockchain:
-            # Check every transaction in each block
-            for transaction in block['transactions']:
-                # If this address received money, add to balance
-                if transaction['recipient'] == address:
-                    balance += transaction['amount']
-
-                # If this address sent money, subtract from balance
-                if 'sender' in transaction:
-                    if transaction['sender'] == address:
-                        balance -= transaction['amount']
-
-        #Also check validated pending transactions
-        with open('my_data/pending_transactions.json', 'r') as f:
-            pending_transactions = json.load(f)
-
-        #Calculating Balance
-        for tranx in pending_transactions:
-            # If this address received money, add to balance
-            if tranx['recipient'] == address:
-                balance += tranx['amount']
-
-            # If this address sent money, subtract from balance
-            if tranx['sender']:
-                if tranx['sender'] == address:
-                    balance -= tranx['amount']
-
-        return balance
+    def verify_target(block, blocks):
+        """Check the block's recorded target against the retarget over the blocks before it"""
+        recent_blocks = blocks[-(RETARGET_WINDOW + 1):]
+        return block['bits'] == next_bits(recent_blocks) and verify_timestamp(block, recent_blocks)
+
+    def get_balance(self, address):
+        # Confirmed balance plus the pending overlay, both kept up to date incrementally
+        return self.ledger.get_balance(address)
+
+    def get_address_transactions(self, address, page=1, page_size=10):
+        """One page of an address's confirmed transactions, newest first, reading only that page's blocks"""
+        if self.address_index is None:
+            transactions = []
+            for height, position, transaction in self.store.get_address_transactions(address, page, page_size):
+                transaction['block_height'] = height
+                transaction['position'] = position
+                transactions.append(transaction)
+            total = self.store.count_address_transactions(address)
+        else:
+            transactions = self._indexed_address_transactions(address, page, page_size)
+            total = self.address_index.count(address)
+
+        return {
+            'address': address,
+            'page': page,
+            'page_size': page_size,
+            'total': total,
+            'transactions': transactions,
+        }
+
+    def _indexed_address_transactions(self, address, page, page_size):
+        blocks = {}
+        transactions = []
+        for height, position in self.address_index.get_page(address, page, page_size):
+            if height not in blocks:
+                blocks[height] = self.store.get_block(height)
+            if blocks[height] is None:
+                # Only the header of a pruned block is left
+                transactions.append({'block_height': height, 'position': position, 'pruned': True})
+                continue
+            transaction = dict(blocks[height]['transactions'][position])
+            transaction['block_height'] = height
+            transaction['position'] = position
+            transactions.append(transaction)
+        return transactions
 
     def get_latest_block_hash(self):
-        path = 'my_data/blockchain.json'
-        with open(path, 'r') as f:
-            blockchain = json.load(f)
-
         #Get latest hash
-        latest_block = blockchain[-1]
-        latest_block_hash = latest_block['hash']
-
-        return latest_block_hash
+        return self.tip_hash
 
     def get_latest_tx(self):
-        with open('my_data/pending_transactions.json', 'r') as f:
-            pending_tx = json.load(f)
-        if len(pending_tx) == 0:
+        latest_tx_hash = self.mempool.latest_hash()
+        if latest_tx_hash is None:
             print("Empty")
             return 'Empty'
         else:
-            print(pending_tx[-1]["tx_hash"])
-            return pending_tx[-1]["tx_hash"]
+            print(latest_tx_hash)
+            return latest_tx_hash
 
     def find_block_height(self):
-        path = 'my_data/blockchain.json'
-        with open(path,  'r') as f:
-            blockchain = json.load(f)
-
-        return len(blockchain)
-
-
-
-
-
-
+        return self.block_height
+
+    def get_merkle_proof(self, tx_hash):
+        """Find the block holding a transaction and prove its inclusion against the block's merkle root"""
+        if hasattr(self.store, 'find_transaction'):
+            # The store indexes tx hashes, only read the one block
+            location = self.store.find_transaction(tx_hash)
+            blocks = [self.store.get_block(location[0])] if location else []
+        else:
+            blocks = self.store.iter_blocks()
+
+        for block in blocks:
+            if block is None:
+                continue  # Pruned
+            tx_hashes = [tx['tx_hash'] for tx in block['transactions']]
+            if tx_hash in tx_hashes:
+                merkle_tree = MerkleTree(tx_hashes, legacy=block['version'] < RAW_MERKLE_VERSION)
+                return {
+                    'block_hash': block['hash'],
+                    'block_index': block['index'],
+                    'merkle_root': block['merkle_root'],
+                    'proof': merkle_tree.get_proof(tx_hash),
+                }
+        return None
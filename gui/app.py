@@ -1,8 +1,8 @@
 from flask import Flask, render_template, jsonify, request
-import json
 import time
 from datetime import datetime
 import random
+from Transactions import DEFAULT_FEE, key_cache, transaction_outputs, transaction_total, verify_cache
 
 app = Flask(__name__,
     static_folder = 'static',  # Custom static folder path
@@ -22,6 +22,8 @@ def dashboard():
     node = app.config.get('node')
     blockchain = app.config.get('blockchain')
 
+    miner = app.config.get('miner')
+
     wallet_address = wallet.address if wallet else 'Unknown'
 
     # Get pending transactions
@@ -34,7 +36,8 @@ def dashboard():
                             recent_transactions = reversed(recent_transactions),
                             pending_transactions_len = len(pending_transactions),
                             pending_transactions = reversed(pending_transactions),
-                           block_height = blockchain.block_height
+                           block_height = blockchain.block_height,
+                           mining = miner.get_status() if miner else None
                             )
 
 @app.route('/send')
@@ -62,18 +65,50 @@ def api_status():
     blockchain = app.config.get('blockchain')
 
     balance = blockchain.get_balance(wallet.address) if all([blockchain, wallet]) else 0
-    block_height = len(blockchain.chain) if blockchain else 0
+    block_height = blockchain.block_height if blockchain else 0
     peer_count = len(node.peers) if node else 0
-    pending_tx = len(node.pending_transactions) if node else 0
+    pending_tx = len(blockchain.mempool) if blockchain else 0
+    miner = app.config.get('miner')
 
     return jsonify({
         'balance': balance,
         'block_height': block_height,
         'peer_count': peer_count,
-        'pending_transactions': pending_tx
+        'pending_transactions': pending_tx,
+        'pruned_height': blockchain.store.pruned_height if blockchain else 0,
+        'verify_cache': verify_cache.stats(),
+        'key_cache': key_cache.stats(),
+        'mining': miner.get_status() if miner else None
     })
 
 
+@app.route('/api/mining')
+def api_mining():
+    """Background miner state and hashrate"""
+    miner = app.config.get('miner')
+    if not miner:
+        return jsonify({'state': 'unavailable'})
+    return jsonify(miner.get_status())
+
+
+@app.route('/api/mining/<action>', methods=['POST'])
+def api_mining_control(action):
+    """Start, stop or cancel the background miner"""
+    miner = app.config.get('miner')
+    if not miner:
+        return jsonify({'error': 'No miner configured'}), 404
+
+    if action == 'start':
+        miner.start()
+    elif action == 'stop':
+        miner.stop()
+    elif action == 'cancel':
+        miner.cancel()
+    else:
+        return jsonify({'error': f'Unknown action {action}'}), 400
+    return jsonify(miner.get_status())
+
+
 @app.route('/send', methods=['POST'])
 def send_transaction():
     node = app.config.get('node')
@@ -84,6 +119,7 @@ def send_transaction():
     balance = blockchain.get_balance(wallet.address)
     recipient = request.form.get('recipient', '').strip()
     amount = float(request.form.get('amount', '').strip())
+    fee = float(request.form.get('fee', '').strip() or DEFAULT_FEE)
 
     check_balance = False
     while check_balance:
@@ -93,7 +129,7 @@ def send_transaction():
             check_balance = False
 
     recipient_address = recipient
-    transaction = wallet.create_transaction(recipient_address=recipient_address, amount=amount)
+    transaction = wallet.create_transaction(recipient_address=recipient_address, amount=amount, fee=fee)
 
     # BROADCAST TRANSACTION TO NETWORK
     validation_id = node.broadcast_transaction(transaction=transaction.to_dict())
@@ -112,20 +148,11 @@ def send_transaction():
         # Add transaction to be displayed in the frontend
         print("Transaction added to pool!")
 
-        #Check if time for mining
+        # The background miner decides when there is enough to mine
         mined = False
-        with open('my_data/pending_transactions.json') as f:
-            pending_tx = json.load(f)
-        if len(pending_tx) >= 5:
-            print("Mining a new block")
-            # Mine
-            new_block = blockchain.mine_block(address=wallet.address)
-
-            if new_block:
-                print(" New block mined!")
-                node.broadcast_new_block(new_block)
-                print("New block broadcasted to network!")
-                mined = True
+        miner = app.config.get('miner')
+        if miner:
+            miner.notify()
 
 
         # Send back to the frontend that the transaction has been validated
@@ -150,6 +177,19 @@ def send_transaction():
                                success=False)
 
 
+@app.route('/api/address/<address>/transactions')
+def api_address_transactions(address):
+    """Paginated transaction history for any address"""
+    blockchain = app.config.get('blockchain')
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+        page_size = min(max(int(request.args.get('page_size', 10)), 1), 100)
+    except ValueError:
+        return jsonify({'error': 'page and page_size must be integers'}), 400
+
+    return jsonify(blockchain.get_address_transactions(address, page=page, page_size=page_size))
+
+
 @app.route('/api/peers')
 def api_peers():
     """Get peer list"""
@@ -166,52 +206,44 @@ def api_peers():
 
     return jsonify(peers)
 
-def my_recent_transactions(limit=5):
-        recent_tx = []
-
-        with open('my_data/blockchain.json', 'r') as f:
-            blockchain = json.load(f)
-
-        with open('my_data/Wallets/wallet.json') as f:
-            wallet = json.load(f)
+def wallet_view(tx, address):
+    """A multi-output transaction as the wallet sees it: all it sent, or only what it was paid"""
+    if 'outputs' not in tx:
+        return tx
+    view = dict(tx)
+    if tx.get('sender') == address:
+        view['amount'] = transaction_total(tx)
+    else:
+        view['amount'] = sum(amount for recipient, amount in transaction_outputs(tx) if recipient == address)
+    return view
 
-        # Go through blocks in reverse order (newest first)
-        for block in reversed(blockchain[-5:]):
-            for tx in block['transactions']:
-                if 'sender' in tx:
-                    if tx['sender'] == wallet:
-                        recent_tx.append(tx)
-                if tx['recipient'] == wallet:
-                    recent_tx.append(tx)
-                    if len(recent_tx) >= limit:
-                        return recent_tx
+def my_recent_transactions(limit=5):
+        wallet = app.config.get('wallet')
+        blockchain = app.config.get('blockchain')
 
-        print(recent_tx)
-        return recent_tx
+        # Newest first, however far back they are in the chain
+        history = blockchain.get_address_transactions(wallet.address, page=1, page_size=limit)
+        # Transactions in pruned blocks only have their position left, nothing to show
+        return [wallet_view(tx, wallet.address) for tx in history['transactions'] if not tx.get('pruned')]
 
 def my_pending_transactions():
-    try:
-        with open('my_data/pending_transactions.json', 'r') as f:
-            tx_data = json.load(f)
-            return [tx_dict for tx_dict in tx_data]
-    except FileNotFoundError:
-        return []
+    wallet = app.config.get('wallet')
+    blockchain = app.config.get('blockchain')
+    return [wallet_view(tx, wallet.address) for tx in blockchain.load_pending_transaction_dicts()]
 
 
 def generate_mock_blockchain_data():
     """Generates blockchain data in the format expected by the D3 frontend."""
-    path = 'my_data/blockchain.json'
-    with open(path, 'r') as f:
-        blockchain = json.load(f)
-    num_blocks = len(blockchain)
+    store = app.config.get('blockchain').store
     nodes = []
     links = []
     no_block = -1
 
-    for block in blockchain:
+    # Only headers and the tx counts from the store index are needed, not the transactions
+    for header in store.iter_headers():
         no_block += 1
         # Generate a unique hash for the block
-        block_hash = block['hash']
+        block_hash = header['hash']
 
         nodes.append({
             "id": f"block-{no_block}",
@@ -219,8 +251,8 @@ def generate_mock_blockchain_data():
             "height": no_block,
             "hash": block_hash,
             "expanded": False,
-            # In a real app, you'd fetch the actual transaction count
-            "tx_count": len(block['transactions'])
+            "tx_count": store.get_tx_count(no_block),
+            "pruned": not store.has_body(no_block)
         })
 
         if no_block > 0:
@@ -241,12 +273,25 @@ def get_blockchain_data():
     return jsonify(data)
 
 
+def block_height_from_id(block_id):
+    """Block ids look like 'block-<height>', None for anything else"""
+    try:
+        height = int(block_id.split('-')[-1])
+    except ValueError:
+        return None
+    return height if height >= 0 else None
+
+
 def generate_mock_transaction_details(block_id, count):
     """Generates a list of detailed transaction objects."""
-    path = 'my_data/blockchain.json'
-    with open(path, 'r') as f:
-        blockchain = json.load(f)
-    block = blockchain[int(block_id[-1])]
+    store = app.config.get('blockchain').store
+    height = block_height_from_id(block_id)
+    if height is None:
+        return None
+
+    block = store.get_block(height)
+    if block is None:
+        return None
     transactions = []
 
     for tx in block['transactions']:
@@ -255,16 +300,20 @@ def generate_mock_transaction_details(block_id, count):
             sender = tx['sender']
         else:
             sender = 'reward'
-        recipient = tx['recipient']
+        outputs = transaction_outputs(tx)
+        recipient = outputs[0][0] if len(outputs) == 1 else f"{len(outputs)} recipients"
         tx_hash = tx['tx_hash']
-        value = tx['amount']
+        value = transaction_total(tx)
 
-        transactions.append({
+        details = {
             "hash": tx_hash,
             "sender": sender,
             "recipient": recipient,
             "value": value
-        })
+        }
+        if 'outputs' in tx:
+            details["outputs"] = tx['outputs']
+        transactions.append(details)
 
     return transactions
 
@@ -284,6 +333,13 @@ def get_transaction_details(block_id):
         count = 1
 
     details = generate_mock_transaction_details(block_id, count)
+    if details is None:
+        store = app.config.get('blockchain').store
+        height = block_height_from_id(block_id)
+        if height is not None and height < len(store) and not store.has_body(height):
+            return jsonify({'error': f'Block {height} was pruned on this node', 'pruned': True,
+                            'pruned_height': store.pruned_height}), 410
+        return jsonify({'error': f'Unknown block {block_id}'}), 404
     return jsonify(details)
 
 if __name__ == '__main__':
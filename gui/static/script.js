@@ -15,6 +15,12 @@ async function refreshData() {
         document.getElementById('peerCount').textContent = data.peer_count;
         document.getElementById('pendingTx').textContent = data.pending_transactions;
 
+        // Update miner state if exists
+        if (data.mining) {
+            document.getElementById('miningState').textContent = data.mining.state;
+            document.getElementById('hashrate').textContent = `${data.mining.hashrate} H/s`;
+        }
+
         // Update send page balance if exists
         const availableBalance = document.getElementById('availableBalance');
         if (availableBalance) {
@@ -119,7 +125,7 @@ async function handleSendForm(event) {
 function validateAmount(input) {
     const amount = parseFloat(input.value) || 0;
     const balance = parseFloat(document.getElementById('currentBalance').textContent) || 0;
-    const fee = 0.001; // Fixed transaction fee
+    const fee = parseFloat(document.getElementById('fee').value) || 0;
     const total = amount + fee;
 
     const totalElement = document.getElementById('totalAmount');
@@ -140,7 +146,7 @@ function validateAmount(input) {
 // Update total amount display
 function updateTotalAmount() {
     const amount = parseFloat(document.getElementById('amount').value) || 0;
-    const fee = 0.001;
+    const fee = parseFloat(document.getElementById('fee').value) || 0;
     const total = amount + fee;
     document.getElementById('totalAmount').textContent = total.toFixed(3);
 }
@@ -0,0 +1,228 @@
+import asyncio
+import json
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from networking.Node import Node
+
+# Same framing as the threaded node: 8-byte network-order length, then the JSON payload
+FRAME_HEADER = struct.Struct('!Q')
+# Refuse frames claiming more than this, a whole chain sent to a new node is the largest legitimate message
+MAX_FRAME_SIZE = 256 * 1024 * 1024
+
+# Threads running message handlers, which may block on disk, signature checks or mining
+HANDLER_WORKERS = 16
+# Seconds a dial or a send may take, and a thread outside the event loop waits for one
+SEND_TIMEOUT = 30.0
+# Seconds submit() waits for the event loop to come up
+STARTUP_TIMEOUT = 10.0
+
+
+class StreamConnection:
+    """Stands in for the socket the message handlers are given, writes go through the event loop"""
+
+    def __init__(self, loop, writer):
+        self.loop = loop
+        self.writer = writer
+
+    def send(self, data):
+        self.loop.call_soon_threadsafe(self.writer.write, data)
+        return len(data)
+
+    sendall = send
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.writer.close)
+
+
+class AsyncNode(Node):
+    """Node whose transport is a single asyncio event loop instead of a thread per connection
+
+    Messages are still routed through Node._process_received_data, run on a bounded thread pool so a slow
+    handler never stalls the loop. Frames from one connection are handled in the order they arrived.
+    Other threads (Flask, the miner) send through submit() / _send_to_peer, which are thread-safe.
+    """
+
+    def __init__(self, port, host, blockchain=None, handler_workers=HANDLER_WORKERS):
+        super().__init__(port, host, blockchain)
+        self.loop = None
+        self.server = None
+        self.started = threading.Event()
+        self.handler_pool = ThreadPoolExecutor(handler_workers, thread_name_prefix='NodeHandler')
+        self._loop_thread = None
+        self._connect_locks = {}  # (host, port) -> asyncio.Lock, so one peer is never dialled twice at once
+        self.inbound_connections = 0
+        self._inbound_writers = set()
+
+    # --- Event loop ---
+
+    def start_server(self):
+        """Run the event loop in the calling thread until stop_server"""
+        self.loop = asyncio.new_event_loop()
+        self._loop_thread = threading.get_ident()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._serve())
+        except Exception as e:
+            print(f"Server fatal error: {e}")
+        finally:
+            self.started.set()  # Do not leave submitters waiting on a loop that is gone
+            self.loop.run_until_complete(self._close_connections())
+            self.loop.close()
+            self.handler_pool.shutdown(wait=False)
+            print("Server shutdown complete")
+
+    async def _serve(self):
+        self.server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        print(f"Node server started on {self.host}:{self.port} (asyncio)")
+        self.started.set()
+        async with self.server:
+            try:
+                await self.server.serve_forever()
+            except asyncio.CancelledError:
+                pass  # stop_server closed it
+
+    def submit(self, coroutine):
+        """Run a coroutine on the node's event loop from any other thread, returns a concurrent Future"""
+        if not self.started.wait(STARTUP_TIMEOUT) or self.loop is None or self.loop.is_closed():
+            coroutine.close()
+            raise RuntimeError("Node event loop is not running")
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def stop_server(self):
+        """Gracefully stop the server"""
+        self.running = False
+        if self.loop is not None and self.server is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.server.close)
+
+    async def _close_connections(self):
+        for _, writer in list(self.active_outgoing_connections.values()):
+            writer.close()
+        self.active_outgoing_connections.clear()
+
+        # Closing the streams ends every handler's read, let them run their cleanup
+        for writer in list(self._inbound_writers):
+            writer.close()
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        if tasks:
+            await asyncio.wait(tasks, timeout=SEND_TIMEOUT)
+
+    # --- Inbound ---
+
+    async def _handle_connection(self, reader, writer):
+        """All communication with one connected node: read frames, hand each to the message handlers"""
+        client_address = writer.get_extra_info('peername')
+        connection = StreamConnection(self.loop, writer)
+        self.inbound_connections += 1
+        self._inbound_writers.add(writer)
+        print(f"Incoming connection from {client_address}")
+        try:
+            while self.running:
+                header = await reader.readexactly(FRAME_HEADER.size)
+                msglen, = FRAME_HEADER.unpack(header)
+                if msglen > MAX_FRAME_SIZE:
+                    print(f"Frame of {msglen} bytes from {client_address} is too large, disconnecting")
+                    break
+                data = await reader.readexactly(msglen)
+                await self.loop.run_in_executor(self.handler_pool, self._process_received_data, data,
+                                                client_address, connection)
+
+        except asyncio.IncompleteReadError:
+            print(f"Node {client_address} disconnected")
+        except (ConnectionError, OSError) as e:
+            print(f" Communication error with {client_address}: {e}")
+        finally:
+            self.inbound_connections -= 1
+            self._inbound_writers.discard(writer)
+            await self.loop.run_in_executor(self.handler_pool, self._cleanup_node_connection, connection,
+                                            client_address)
+
+    # --- Outbound ---
+
+    async def _open_connection(self, host, port):
+        """Writer for a persistent connection to the peer, dialling it the first time"""
+        lock = self._connect_locks.setdefault((host, port), asyncio.Lock())
+        async with lock:
+            connection = self.active_outgoing_connections.get((host, port))
+            if connection is None:
+                # An unreachable peer must not hold the lock, and every send queued behind it, indefinitely
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), SEND_TIMEOUT)
+                connection = (reader, writer)
+                self.active_outgoing_connections[(host, port)] = connection
+                self.loop.create_task(self._listen_to_peer_async(reader, writer, (host, port)))
+            return connection[1]
+
+    async def send_message(self, host, port, message):
+        """Send one framed message to a peer, keeping the connection open for the next one"""
+        payload = json.dumps(message).encode()
+        writer = await self._open_connection(host, port)
+        try:
+            writer.write(FRAME_HEADER.pack(len(payload)) + payload)
+            await asyncio.wait_for(writer.drain(), SEND_TIMEOUT)
+        except (ConnectionError, OSError, asyncio.TimeoutError):
+            self._drop_outgoing((host, port), writer)
+            raise
+
+    def _send_to_peer(self, host, port, message):
+        """Thread-safe send, blocks the calling thread until the message is written"""
+        if threading.get_ident() == self._loop_thread:
+            # Called from the loop itself, waiting here would deadlock it
+            self.loop.create_task(self.send_message(host, port, message))
+            return
+        future = self.submit(self.send_message(host, port, message))
+        try:
+            future.result(SEND_TIMEOUT)
+        except FutureTimeoutError:
+            # Nobody is waiting for it any more, do not leave it running on the loop
+            future.cancel()
+            raise
+
+    def connect_to_peer_with_handshake(self, host, port, connection_type="REGULAR"):
+        try:
+            print(f" Connecting to {host}:{port} as {connection_type} peer...")
+            self._send_to_peer(host, port, self._create_handshake(connection_type))
+            print(f" Sent {connection_type} handshake to {host}:{port}")
+            return True
+
+        except Exception as e:
+            print(f"Failed to connect to {host}:{port}: {e}")
+            return False
+
+    async def _listen_to_peer_async(self, reader, writer, peer_address):
+        """Replies on an outbound connection, which peers write as bare JSON documents rather than frames"""
+        decoder = json.JSONDecoder()
+        connection = StreamConnection(self.loop, writer)
+        buffer = ''
+        try:
+            while self.running:
+                chunk = await reader.read(65536)
+                if not chunk:
+                    break
+                buffer += chunk.decode('utf-8', errors='replace')
+                while True:
+                    buffer = buffer.lstrip()
+                    try:
+                        _, end = decoder.raw_decode(buffer)
+                    except json.JSONDecodeError:
+                        break  # Incomplete, wait for more
+                    data, buffer = buffer[:end].encode(), buffer[end:]
+                    await self.loop.run_in_executor(self.handler_pool, self._process_received_data, data,
+                                                    peer_address, connection)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self._drop_outgoing(peer_address, writer)
+
+    def _drop_outgoing(self, peer_address, writer):
+        connection = self.active_outgoing_connections.get(peer_address)
+        if connection is not None and connection[1] is writer:
+            del self.active_outgoing_connections[peer_address]
+        writer.close()
+
+    def get_server_status(self):
+        status = super().get_server_status()
+        status['transport'] = 'asyncio'
+        status['inbound_connections'] = self.inbound_connections
+        status['outbound_connections'] = len(self.active_outgoing_connections)
+        return status
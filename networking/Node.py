@@ -12,13 +12,14 @@ from Transactions import Transactions
 from blockchain.blockchain import BlockChain
 
 class Node:
-    def __init__(self, port, host):
+    def __init__(self, port, host, blockchain=None):
         self.host = host
         self.port = port
         self.peers = self.load_peers_from_file()
         self.running = True
         self.current_active_peers = []
-        self.blockchain_path = 'my_data/blockchain.json'
+        # Share the BlockChain (and its block store) with the rest of the process
+        self.blockchain = blockchain if blockchain is not None else BlockChain()
 
         self.node_id = f"node_{host}_{port}"  # Unique identifier
         self.capabilities = ['transaction_relay', 'block_validation']
@@ -31,10 +32,16 @@ class Node:
         self.pending_validation_ids = []
         self.pending_validation = {}
 
+        # (host, port) -> lowest height whose body that peer still has, 0 for peers that keep the full history
+        self.peer_pruned_heights = {}
+
+        # Background Miner, set by Main once the wallet is loaded
+        self.miner = None
+
     def setup(self):
         if self.port == 5000:
             pass
-        elif os.path.exists(self.blockchain_path):
+        elif len(self.blockchain.store) > 0:
             pass
         else:
             self.connect_to_bootstrap()
@@ -61,19 +68,14 @@ class Node:
             blockchain_data = blockchain
             print(blockchain_data)
 
-            # Now save as proper .json file
-            folder_path = 'my_data/blockchain.json'
-            file_name = 'blockchain.json'
-            file_path = os.path.join(folder_path, file_name)
-
+            # Now replace our block log with the received chain
             try:
-                with open(folder_path, "w") as f:  # "w" mode creates a new file or overwrites if it exists
-                    json.dump(blockchain_data, f, indent=2)
-                print(f"File '{file_name}' created in '{folder_path}'.")
+                if not self.blockchain.replace_chain(blockchain_data):
+                    return
             except IOError as e:
-                print(f"Error creating file: {e}")
+                print(f"Error writing block log: {e}")
 
-            print(f"Saved {len(blockchain_data)} {file_path}")
+            print(f"Saved {len(blockchain_data)} blocks to {self.blockchain.store.path}")
 
         except Exception as e:
             print(f"Error processing blockchain data: {e}")
@@ -97,12 +99,7 @@ class Node:
                 print(f"Established connection to {host}:{port}")
 
             # SEND APPROPRIATE HANDSHAKE BASED ON CONNECTION TYPE
-            if connection_type == "BOOTSTRAP":
-                handshake_msg = self._create_bootstrap_handshake()
-            elif connection_type == "REGULAR":
-                handshake_msg = self._create_peer_handshake()
-            else:
-                handshake_msg = self._create_basic_handshake()
+            handshake_msg = self._create_handshake(connection_type)
 
             # Send handshake using existing method
             self._send_to_peer(host, port, handshake_msg)
@@ -115,6 +112,13 @@ class Node:
             print(f"Failed to connect to {host}:{port}: {e}")
             return False
 
+    def _create_handshake(self, connection_type):
+        if connection_type == "BOOTSTRAP":
+            return self._create_bootstrap_handshake()
+        elif connection_type == "REGULAR":
+            return self._create_peer_handshake()
+        return self._create_basic_handshake()
+
     def _create_bootstrap_handshake(self):
         return {
             'type': 'JOIN_NETWORK_REQUEST',
@@ -122,6 +126,7 @@ class Node:
             'node_id': self.node_id,
             'capabilities': self.capabilities,
             'blockchain_height': 0,
+            'pruned_height': self.blockchain.store.pruned_height,
             'timestamp': time.time(),
             'handshake_type': 'BOOTSTRAP'
         }
@@ -133,6 +138,7 @@ class Node:
             'node_address': (self.host, self.port),
             'node_id': self.node_id,
             'capabilities': self.capabilities,
+            'pruned_height': self.blockchain.store.pruned_height,
             'timestamp': time.time(),
             'handshake_type': 'REGULAR'
         }
@@ -155,6 +161,7 @@ class Node:
                 # Extract their REAL listening port (not ephemeral)
                 their_host, their_port = message['node_address']
                 their_node_id = message['node_id']
+                self.peer_pruned_heights[(their_host, their_port)] = message.get('pruned_height', 0)
 
                 # Validate and accept
                 if self._validate_join_request(message):
@@ -213,12 +220,11 @@ class Node:
     def _send_blockchain_to_new_node(self, host, port):
         # Send blockchain to newly joined node
         try:
-            path = "my_data/blockchain.json"
-            if os.path.exists(path):
-                with open(path, 'r') as f:
-                    blockchain_data = json.load(f)
-
-
+            if self.blockchain.store.pruned_height:
+                # We only have recent bodies, point the new node at peers that can send the whole chain
+                self._send_chain_pruned(host, port)
+            elif len(self.blockchain.store) > 0:
+                blockchain_data = self.blockchain.store.get_blocks()
 
                 blockchain_msg = {
                     'type': 'BLOCKCHAIN_DATA',
@@ -366,6 +372,9 @@ class Node:
             elif message_type == 'NEW_TRANSACTION':
                 self._handle_new_transaction(message)
 
+            elif message_type == 'NEW_TRANSACTIONS':
+                self._handle_new_transactions(message)
+
             elif message_type == 'TRANSACTION_VALIDATION':
                 self.response_validation(msg = message)
 
@@ -375,6 +384,9 @@ class Node:
             elif message_type == 'CHAIN_REQUEST':
                 self._handle_chain_request(message)
 
+            elif message_type == 'CHAIN_PRUNED':
+                self._handle_chain_pruned(message)
+
             elif message_type == 'TX_REQUEST':
                 self._handle_tx_update_request(message)
 
@@ -441,7 +453,9 @@ class Node:
         return {
             'listening_on': f"{self.host}:{self.port}",
             'active_peers': len(self.peers),
-            'is_running': self.running
+            'is_running': self.running,
+            'pruned_height': self.blockchain.store.pruned_height,
+            'mining': self.miner.get_status() if self.miner else None
         }
 
     def _send_to_peer(self, host, port, message):
@@ -560,6 +574,21 @@ class Node:
 
     def broadcast_transaction(self, transaction, status='Unvalidated'):
         """Broadcast transaction to all peers"""
+        return self._broadcast_for_validation({
+            'type': 'NEW_TRANSACTION',
+            'status': status,
+            'transaction': transaction,
+        })
+
+    def broadcast_transactions(self, transactions, status='Unvalidated'):
+        """Broadcast a batch, e.g. from Wallet.create_transactions, as one message peers vote on as a whole"""
+        return self._broadcast_for_validation({
+            'type': 'NEW_TRANSACTIONS',
+            'status': status,
+            'transactions': transactions,
+        })
+
+    def _broadcast_for_validation(self, content):
         #Add new pending_validation_id
 
         validation_id = len(self.pending_validation_ids) + 1
@@ -570,9 +599,7 @@ class Node:
             'broadcaster_host': f'{self.host}',
             'broadcaster_port': f'{self.port}',
             'validation_id': validation_id,
-            'type': 'NEW_TRANSACTION',
-            'status': status,
-            'transaction': transaction,
+            **content,
             'timestamp': time.time()
         }
 
@@ -616,13 +643,8 @@ class Node:
 
                 tranx_object = Transactions.from_dict(msg['transaction'])
 
-                valid = False
-                #  Valid the transaction
-                if tranx_object.is_valid():
-                    valid = True
-
-                else:
-                    valid = False
+                #  Valid the transaction, on the verifier's process pool so concurrent relays use every core
+                valid = self.blockchain.verifier.verify_transaction(tranx_object.to_dict())
 
                 print(f"transaction is {valid}")
                 # Send back the response
@@ -639,27 +661,40 @@ class Node:
                 print(f'Error at handle_new_transaction :{e}')
 
         elif transaction_status == 'Validated':
-            path = 'my_data/pending_transactions.json'
-            # Write transaction to the pending transactions.json in mydata folder
-            try:
-                with open(path, 'r') as f:
-                    tx_data = json.load(f)
+            # Write transaction to the pending pool, which also updates the pending balances
+            if self.blockchain.add_validated_transaction(msg['transaction']):
+                print("New transaction added to transaction pool, peer")
+                if self.miner:
+                    self.miner.notify()
+
+            else:
+                print("Transaction already in transasction pool or rejected by the mempool")
 
-            except FileNotFoundError:
-                    tx_data = []
+    def _handle_new_transactions(self, msg):
+        """A batch is valid only if every transaction in it is, one vote goes back for the whole batch"""
+        transaction_status = msg['status']
+        if transaction_status == "Unvalidated":
+            try:
+                valid = all(self.blockchain.verifier.verify_transactions(msg['transactions']))
 
-            # Check if the transaction is already in the file
-            if msg['transaction'] not in tx_data:
-                tx_data.append(msg['transaction'])
+                print(f"transaction batch of {len(msg['transactions'])} is {valid}")
+                transaction_message = {
+                    'type': 'TRANSACTION_VALIDATION',
+                    'is_valid': f"{valid}",
+                    'Validator': f"{self.port}",
+                    'validation_id': msg['validation_id']
+                }
 
-                #Save the json folder
-                with open(path, 'w') as f:
-                    json.dump(tx_data, f, indent=2)
+                self._send_to_peer(msg['broadcaster_host'], int(msg['broadcaster_port']), transaction_message)
 
-                print("New transaction added to transaction pool, peer")
+            except Exception as e:
+                print(f'Error at handle_new_transactions :{e}')
 
-            elif msg['transaction'] in tx_data:
-                print("Transaction already in transasction pool")
+        elif transaction_status == 'Validated':
+            added = sum(self.blockchain.add_validated_transaction(tx_dict) for tx_dict in msg['transactions'])
+            print(f"{added} of {len(msg['transactions'])} batch transactions added to transaction pool, peer")
+            if added and self.miner:
+                self.miner.notify()
 
     def response_validation(self, msg):
         # Check if msg in pending_validation
@@ -690,10 +725,11 @@ class Node:
             return 'Pending'
 
     def _handle_new_block(self, block):
-        path = 'my_data/blockchain.json'
-        path_2 = 'my_data/pending_transactions.json'
-        BlockChain.save_new_block(block=block, path=path, path_pending_tranx=path_2)
-        print("Block successfully mined")
+        if self.blockchain.save_new_block(block=block):
+            print("Block successfully mined")
+            # Our own template now builds on a stale parent
+            if self.miner:
+                self.miner.on_new_tip(block['hash'])
 
     def update_blockchain(self, latest_hash):
         # Sending to other peers to get latest_data
@@ -702,6 +738,7 @@ class Node:
             'broadcaster_port': f'{self.port}',
             'type' : 'CHAIN_REQUEST',
             'latest_hash' : latest_hash,
+            'pruned_height': self.blockchain.store.pruned_height,
         }
 
         for peer_host, peer_port in self.peers:
@@ -711,6 +748,42 @@ class Node:
             except:
                 pass
 
+    def archive_peers(self):
+        """Peers known to still serve every block body"""
+        return [peer for peer in self.peers if self.peer_pruned_heights.get(tuple(peer)) == 0]
+
+    def _send_chain_pruned(self, host, port):
+        self._send_to_peer(host, port, {
+            'type': 'CHAIN_PRUNED',
+            'broadcaster_host': f'{self.host}',
+            'broadcaster_port': f'{self.port}',
+            'pruned_height': self.blockchain.store.pruned_height,
+            'archive_peers': self.archive_peers(),
+            'timestamp': time.time()
+        })
+
+    def _handle_chain_pruned(self, message):
+        """A peer could not serve the bodies we asked for, ask the peers it knows to have them"""
+        sender = (message['broadcaster_host'], int(message['broadcaster_port']))
+        self.peer_pruned_heights[sender] = message['pruned_height']
+        print(f"{sender[0]}:{sender[1]} pruned bodies below height {message['pruned_height']}")
+
+        request = {
+            'broadcaster_host': f'{self.host}',
+            'broadcaster_port': f'{self.port}',
+            'type': 'CHAIN_REQUEST',
+            'latest_hash': self.blockchain.get_latest_block_hash(),
+            'pruned_height': self.blockchain.store.pruned_height,
+        }
+        for peer_host, peer_port in message.get('archive_peers', []):
+            if (peer_host, peer_port) in (sender, (self.host, self.port)):
+                continue
+            try:
+                self._send_to_peer(peer_host, peer_port, request)
+                print(f"Sent Chain request to archive peer {peer_host}:{peer_port}")
+            except:
+                pass
+
     def update_tx(self, latest_tx):
         # Sending to other peers to get latest_data
         update_status = {
@@ -728,52 +801,54 @@ class Node:
                 pass
 
     def _handle_chain_request(self, request_data):
-        path = 'my_data/blockchain.json'
-        # Check against your chain hashes
-        with open(path, 'r') as f:
-            blockchain = json.load(f)
-        for block in blockchain:
-            if block['hash'] == request_data['latest_hash']:
-                current_block_index = blockchain.index(block)
-                number_of_blocks_missing = len(blockchain) - (current_block_index + 1)
-                missing_blocks = []
-                if number_of_blocks_missing > 0:
-                    for i in range(current_block_index+1, len(blockchain)):
-                        missing_blocks.append(blockchain[i])
-
-                    for m_block in missing_blocks:
-                        block_message = {
-                            'type': 'NEW_BLOCK',
-                            'block': m_block,
-                            'timestamp': time.time()
-                        }
-                        # send back missing blocks
-                        self._send_to_peer(request_data['broadcaster_host'], int(request_data['broadcaster_port']), block_message)
-                        print(f"Sent {number_of_blocks_missing} missing blocks to {request_data['broadcaster_host']}:{request_data['broadcaster_port']}")
-                else:
-                    block_message = {
-                        'type': "TEST_MESSAGE",
-                        'message': 'No missing blocks',
-                        'timestamp': time.time()
-                    }
-                    self._send_to_peer(request_data['broadcaster_host'], int(request_data['broadcaster_port']),
-                                       block_message)
+        store = self.blockchain.store
+        requester = (request_data['broadcaster_host'], int(request_data['broadcaster_port']))
+        self.peer_pruned_heights[requester] = request_data.get('pruned_height', 0)
 
-        else:
+        if request_data['latest_hash'] is None:
+            # Their chain is empty, send all of it (or the archive peers that have it)
+            self._send_blockchain_to_new_node(*requester)
+            return
+
+        # Check against your chain hashes
+        current_block_index = store.get_height(request_data['latest_hash'])
+        if current_block_index is None:
+            block_message = {
+                'type': "TEST_MESSAGE",
+                'message':'Unknown block hash',
+                'timestamp': time.time()
+            }
+            self._send_to_peer(request_data['broadcaster_host'], int(request_data['broadcaster_port']), block_message)
+            return
+
+        number_of_blocks_missing = len(store) - (current_block_index + 1)
+        if current_block_index + 1 < store.pruned_height:
+            # The bodies they are missing are gone here
+            self._send_chain_pruned(*requester)
+        elif number_of_blocks_missing > 0:
+            for m_block in store.iter_blocks(current_block_index + 1):
                 block_message = {
-                    'type': "TEST_MESSAGE",
-                    'message':'Unknown block hash',
+                    'type': 'NEW_BLOCK',
+                    'block': m_block,
                     'timestamp': time.time()
                 }
+                # send back missing blocks
                 self._send_to_peer(request_data['broadcaster_host'], int(request_data['broadcaster_port']), block_message)
+            print(f"Sent {number_of_blocks_missing} missing blocks to {request_data['broadcaster_host']}:{request_data['broadcaster_port']}")
+        else:
+            block_message = {
+                'type': "TEST_MESSAGE",
+                'message': 'No missing blocks',
+                'timestamp': time.time()
+            }
+            self._send_to_peer(request_data['broadcaster_host'], int(request_data['broadcaster_port']),
+                               block_message)
 
         #Missing transactions
 
     def _handle_tx_update_request(self, request_data):
-        path = 'my_data/pending_transactions.json'
         # Check against your tx hashes
-        with open(path, 'r') as f:
-            transactions = json.load(f)
+        transactions = self.blockchain.load_pending_transaction_dicts()
         if request_data['latest_hash'] == 'Empty':
             #Send all transactions
             for tx in transactions: